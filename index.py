@@ -8,6 +8,9 @@ import traceback
 # 引入自定义模块
 from mytools import tools
 from mytools import glob
+from mytools import server
+from mytools import stats
+import task
 
 
 def write_log(_msg, _file_type = 'cli', _params = None, _remark = None):
@@ -28,63 +31,89 @@ def write_log(_msg, _file_type = 'cli', _params = None, _remark = None):
     tools.logs('/' + _file_type + '/error.log', content, 'error', _type = 3)
 
 
-create_time = tools.get_date('%Y-%m-%d %H:%M:%S')
-glob.init()  # 初始化全局变量
-glob.set_value('create_time', create_time)  # 记录创建时间
+def run(_path, _params = None):
+    """
+    执行任务
+    :param str _path: 执行方法路径：/xxx/xxx
+    :param str or None _params: 请求参数
+    :return:
+    """
+    argv = [_path, _params] if _params else [_path]
+    create_time = tools.get_date('%Y-%m-%d %H:%M:%S')
+    glob.init()  # 初始化全局变量
+    glob.set_value('create_time', create_time)  # 记录创建时间
 
-# 获取命令行参数：本文件路径, 执行方法路径[, 请求参数[, 其他]]
-params = copy.deepcopy(sys.argv)
-# 去掉第一个参数：本文件路径
-params.pop(0)
+    # 执行方法路径：/xxx/xxx
+    # 2、字符串切割，获取类名、方法名
+    path = _path.strip('/').split('/')
+    if len(path) != 2 or not path[0] or not path[1]:
+        return write_log("Path must be '/xxx/xxx'", _params = argv)
+    _class_name, _func_name = path
+    glob.set_value('path', '{}/{}'.format(_class_name, _func_name))  # 记录访问路径
+    _class_name = tools.upper_first(_class_name.strip())  # 类名，首字母大写
+    _func_name = _func_name.strip()  # 方法名
 
-# 1、参数验证
-if not params:
-    exit(write_log('Miss param', _params = sys.argv))
+    # 记录请求参数
+    if _params:
+        glob.set_value('params', _params)
 
-# 执行方法路径：/xxx/xxx
-# 2、字符串切割，获取类名、方法名
-_class_name, _func_name = params.pop(0).strip('/').split('/')
-if not _class_name or not _func_name:
-    exit(write_log("Path must be '/xxx/xxx'", _params = sys.argv))
-glob.set_value('path', '{}/{}'.format(_class_name, _func_name))  # 记录访问路径
-_class_name = tools.upper_first(_class_name.strip())  # 类名，首字母大写
-_func_name = _func_name.strip()  # 方法名
+    # 执行函数
+    try:
+        task.init()  # 加载本次任务的创建时间、请求参数
+        task.check_task()  # 检测是否存在重复任务
+        _module = __import__('task.' + _class_name)  # 加载 C 模块
+        _module = getattr(_module, _class_name)  # 加载 C._class 模块
+        _class = getattr(_module, _class_name)  # 加载 C._class._class 类
+        _func = getattr(_class(), _func_name)  # 加载 C._class._class 类的 _func 函数
+        _func()  # 调用 _func 函数
+    except KeyboardInterrupt:
+        # 跳过，主动断开
+        pass
+    except ModuleNotFoundError:
+        write_log("No module named 'task.{}'".format(_class_name), _params = argv)
+    except Exception as e:
+        details = traceback.format_exc()  # 获取代码执行顺序
+        details = details.split('\n')[3:-1]  # 去除无关提示
+        positions = []  # 到达报错位置的每个调用节点
+        for detail in details[:-1:2]:
+            positions.append(detail.strip())
 
-# 记录请求参数
-if params:
-    glob.set_value('params', params.pop(0))
+        kwargs = {
+            '_msg': {
+                'positions': positions,
+                'error': details.pop()
+            }
+        }
+        # 日志文件类型，默认为：cli (即：client)
+        # 例子：raise ValueError('xxxx', '_file_type', '_remark')
+        if tools.is_set(e.args, 1):
+            kwargs['_file_type'] = e.args[1]
+        kwargs['_params'] = argv
+        if tools.is_set(e.args, 2):
+            kwargs['_remark'] = e.args[2]
+        write_log(**kwargs)
+    finally:
+        task.release_task()  # 释放任务锁：常驻进程中子进程不会退出
+        # 写入 Mongo 后台队列中剩余的数据：常驻进程的子进程通过 os._exit 退出，不执行 atexit
+        if 'mytools.mongo' in sys.modules:
+            sys.modules['mytools.mongo'].close_writers()
+        stats.dump(_path)  # 记录本次任务的耗时统计汇总
 
-# 执行函数
-try:
-    tools.set_stdout()  # 设置中文输出，解决编码问题
-    _module = __import__('task.' + _class_name)  # 加载 C 模块
-    _module = getattr(_module, _class_name)  # 加载 C._class 模块
-    _class = getattr(_module, _class_name)  # 加载 C._class._class 类
-    _func = getattr(_class(), _func_name)  # 加载 C._class._class 类的 _func 函数
-    _func()  # 调用 _func 函数
-except KeyboardInterrupt:
-    # 跳过，主动断开
-    pass
-except ModuleNotFoundError:
-    write_log("No module named 'task.{}'".format(_class_name), _params = sys.argv)
-except Exception as e:
-    details = traceback.format_exc()  # 获取代码执行顺序
-    details = details.split('\n')[3:-1]  # 去除无关提示
-    positions = []  # 到达报错位置的每个调用节点
-    for detail in details[:-1:2]:
-        positions.append(detail.strip())
 
-    kwargs = {
-        '_msg': {
-            'positions': positions,
-            'error': details.pop()
-        }
-    }
-    # 日志文件类型，默认为：cli (即：client)
-    # 例子：raise ValueError('xxxx', '_file_type', '_remark')
-    if tools.is_set(e.args, 1):
-        kwargs['_file_type'] = e.args[1]
-    kwargs['_params'] = sys.argv
-    if tools.is_set(e.args, 2):
-        kwargs['_remark'] = e.args[2]
-    write_log(**kwargs)
+if __name__ == '__main__':
+    # 获取命令行参数：本文件路径, 执行方法路径[, 请求参数[, 其他]]
+    params = copy.deepcopy(sys.argv)
+    # 去掉第一个参数：本文件路径
+    params.pop(0)
+
+    # 1、参数验证
+    if not params:
+        exit(write_log('Miss param', _params = sys.argv))
+
+    tools.set_stdout()  # 设置中文输出，解决编码问题
+    _path = params.pop(0)
+    if _path == '--serve':
+        # 常驻进程：预加载任务模块，通过本地 socket 接收任务
+        server.serve(run)
+    else:
+        run(_path, params.pop(0) if params else None)
@@ -0,0 +1,281 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+异步 Mongo 模块(基于 motor)
+    - 方法与 Mongo 相同，返回协程(调用时即读取 page、row_format 等链式设置)
+    - 不检查数据库是否存在
+    - 例子：
+        db = AsyncMongo()
+        tables = tools.run_async(db.list_collections('log'))
+        tasks = [db.count(table, {'status': 1}) for table in tables]
+        result = tools.run_async(tools.gather(tasks, 10))
+"""
+import time
+import asyncio
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:
+    AsyncIOMotorClient = None
+
+# 自定义模块
+from mytools import tools
+from mytools import stats as _stats  # 别名：避免与 stats 方法重名
+from mytools.mongo import get_client_options, get_pipeline, get_count_pipeline, get_count_result, \
+    get_sum_pipeline, get_sum_result, get_metrics_pipeline, get_metrics_result, get_rows, is_simple_keys
+
+
+# 客户端：{(配置分组, id(事件循环)): AsyncIOMotorClient}
+_clients = {}
+
+
+class AsyncMongo(object):
+    def __init__(self, _localhost = None, _section = None):
+        """
+        初始化
+        :param bool _localhost: true -> 本地数据库 | false -> 外网数据库
+        :param str|None _section: 配置分组(优先于 _localhost)
+        """
+        if AsyncIOMotorClient is None:
+            raise ImportError("No module named 'motor'", 'mongo')
+        _localhost = True if _localhost is None else _localhost
+        if not _section:
+            _section = 'mongo' if _localhost else 'mongo2'
+        self.__section = _section
+        self.__config = tools.configs(_section = _section)
+        self.__skip = 0  # 跳过前 n 条
+        self.__limit = 0  # 每次查询数据量
+        self.__format = 'dict'  # 查询结果格式
+
+    def set_default(self):
+        """
+        设置默认值
+        :return:
+        """
+        self.__skip = 0
+        self.__limit = 0
+        self.__format = 'dict'
+
+    def get_client(self):
+        """
+        获取当前事件循环的客户端
+        :return:
+        :rtype: AsyncIOMotorClient
+        """
+        key = (self.__section, id(asyncio.get_event_loop()))
+        client = _clients.get(key)
+        if client is None:
+            config = self.__config
+            client = _clients[key] = AsyncIOMotorClient(config['host'], int(config['port']),
+                                                        **get_client_options(config))
+        return client
+
+    def set_col(self, _table):
+        """
+        选择集合
+        :param str _table: 数据库.集合
+        :return:
+        """
+        table = _table.split('.') if isinstance(_table, str) else []
+        if len(table) != 2:
+            raise ValueError("Param _table's form is wrong", 'mongo')
+        return self.get_client()[table[0]][table[1]]
+
+    def select(self, _table, _where = None, _keys = None, _order = None):
+        """
+        获取单条数据，参数同 Mongo.select
+        :return: False, None or dict
+        :rtype: dict or bool
+        """
+        self.set_default()
+        return self.__find(_table, _order, _keys, _where, None, 0, 1, 'select', 'dict')
+
+    def selects(self, _table, _order = None, _keys = None, _where = None, _group = None):
+        """
+        获取多条数据，参数同 Mongo.selects
+        :return: False, None or list
+        :rtype: list[dict] or bool
+        """
+        skip, limit, _format = self.__skip, self.__limit, self.__format
+        self.set_default()
+        return self.__find(_table, _order, _keys, _where, _group, skip, limit, 'selects', _format)
+
+    async def __find(self, _table, _order, _keys, _where, _group, _skip, _limit, _name, _format):
+        """
+        执行 select、selects：未分组且投影不含表达式时使用 find()，否则使用聚合
+        :return:
+        """
+        start = time.time()
+        try:
+            conn_col = self.set_col(_table)
+            if _group or (_keys and not is_simple_keys(_keys)):
+                cursor = conn_col.aggregate(get_pipeline(_order, _keys, _where, _group, _skip, _limit))
+            else:
+                cursor = conn_col.find(_where if _where else {}, _keys if _keys else None)
+                if _order:
+                    cursor = cursor.sort([(k, v) for (k, v) in _order.items()])
+                if _limit:
+                    cursor = cursor.skip(_skip).limit(_limit)
+            rows = await cursor.to_list(None)
+            if _name == 'select':
+                res = rows[0] if rows else {}
+            else:
+                res = get_rows(rows, _format)
+        except Exception as e:
+            print(e)
+            rows = []
+            res = False
+        _stats.record('mongo', '{}.{} {}'.format(_table, _name, _stats.get_mongo_shape(_where)), time.time() - start,
+                     len(rows), _detail = _where)
+
+        return res
+
+    def aggregate(self, _table, _pipeline):
+        """
+        聚合操作，参数同 Mongo.aggregate
+        :return:
+        :rtype: list | dict | bool
+        """
+        _format = self.__format
+        self.set_default()
+        return self.__aggregate(_table, _pipeline, 'aggregate', lambda rows: get_rows(rows, _format))
+
+    def count(self, _table, _where = None, _key = None, _group = None):
+        """
+        计数，参数同 Mongo.count
+        :return: False or 数据量
+        :rtype: bool|int|list[dict]
+        """
+        self.set_default()
+        return self.__aggregate(_table, get_count_pipeline(_where, _key, _group), 'count',
+                                lambda rows: get_count_result(rows, _group))
+
+    def sum(self, _table, _key, _where = None, _group = None):
+        """
+        求和，参数同 Mongo.sum
+        :return:
+        :rtype: int | dict | list[dict]
+        """
+        self.set_default()
+        pipeline = get_sum_pipeline(_where, _key, _group)
+        if pipeline is None:
+            print("Param '_key' can not be empty, and its form should be str, list or dict")
+            return self.result(False)
+        return self.__aggregate(_table, pipeline, 'sum', lambda rows: get_sum_result(rows, _key, _group))
+
+    def stats(self, _table, _where = None, _group = None, _metrics = None):
+        """
+        多指标统计，参数同 Mongo.stats
+        :return:
+        :rtype: bool, dict or list[dict]
+        """
+        self.set_default()
+        pipeline = get_metrics_pipeline(_where, _group, _metrics)
+        if pipeline is None:
+            print("Param '_metrics' can not be empty, and its form should be {name: count | (op, key)}")
+            return self.result(False)
+        return self.__aggregate(_table, pipeline, 'stats', lambda rows: get_metrics_result(rows, _group, _metrics))
+
+    # 别名
+    metrics = stats
+
+    async def __aggregate(self, _table, _pipeline, _name, _result):
+        """
+        执行聚合
+        :param str _table: 表
+        :param list _pipeline: 聚合条件
+        :param str _name: 方法名(用于统计)
+        :param function _result: 转换结果 _result(list[dict])
+        :return:
+        """
+        if not _pipeline:
+            print("Param '_pipeline' can not be empty")
+            return False
+        start = time.time()
+        rows = []
+        try:
+            rows = await self.set_col(_table).aggregate(_pipeline).to_list(None)
+            res = _result(rows)
+        except Exception as e:
+            print(e)
+            res = False
+        _stats.record('mongo', '{}.{} {}'.format(_table, _name, _stats.get_mongo_shape(_pipeline)),
+                     time.time() - start, len(rows), _detail = _pipeline)
+
+        return res
+
+    def distinct(self, _table, _key = None, _where = None):
+        """
+        去重，参数同 Mongo.distinct
+        :return:
+        :rtype: bool or list
+        """
+        self.set_default()
+        return self.__distinct(_table, _key, _where)
+
+    async def __distinct(self, _table, _key, _where):
+        """
+        执行 distinct
+        :return:
+        """
+        start = time.time()
+        try:
+            res = list(await self.set_col(_table).distinct(_key, _where))
+        except Exception as e:
+            print(e)
+            res = False
+        _stats.record('mongo', '{}.distinct {}'.format(_table, _stats.get_mongo_shape(_where)), time.time() - start,
+                      len(res) if res else 0, _detail = _where)
+
+        return res
+
+    @staticmethod
+    async def result(_result):
+        """
+        直接返回结果(协程)
+        :param _result:
+        :return:
+        """
+        return _result
+
+    async def list_collections(self, _db_name):
+        """
+        获取指定数据库下所有集合名称，同 Mongo.list_collections
+        :param str _db_name: 数据库
+        :return: 数据库.集合
+        :rtype: list[str]
+        """
+        col_lists = await self.get_client()[_db_name].list_collection_names()
+        col_lists.sort()
+        return [_db_name + '.' + col for col in col_lists if col != 'system.indexes']
+
+    def page(self, _page = 1, _count = 10):
+        """
+        分页，同 Mongo.page
+        :return:
+        """
+        if _count:
+            self.__skip = _count * (_page - 1)
+            self.__limit = _count
+        return self
+
+    def row_format(self, _format = 'dict'):
+        """
+        设置 selects、aggregate 查询结果格式，同 Mongo.row_format
+        :return:
+        """
+        if _format not in ('dict', 'column', 'array', 'numpy'):
+            raise ValueError("Param '_format' must be one of dict, column, array, numpy", 'mongo')
+        self.__format = _format
+        return self
+
+
+def close_clients():
+    """
+    关闭当前事件循环的所有客户端
+    :return:
+    """
+    loop_id = id(asyncio.get_event_loop())
+    for key in list(_clients.keys()):
+        if key[1] == loop_id:
+            _clients.pop(key).close()
@@ -0,0 +1,244 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+异步 MySql 模块(基于 aiomysql)
+    - 方法与 MySql 相同，返回协程(调用时即拼接 SQL，page、row_format 等链式设置在调用时生效)
+    - 例子：
+        db = AsyncMySql()
+        tasks = [db.count('log_' + day) for day in days]
+        result = tools.run_async(tools.gather(tasks, 10))
+"""
+import time
+import asyncio
+
+try:
+    import aiomysql
+except ImportError:
+    aiomysql = None
+
+# 自定义模块
+from mytools import tools
+from mytools import stats
+from mytools.mysql import MySql, get_rows, get_types, get_value
+
+
+# 连接池：{(host, port, username, database, charset, id(事件循环)): Future(aiomysql.Pool)}
+_pools = {}
+
+
+class AsyncMySql(object):
+    def __init__(self, conf = None, _section = 'mysql'):
+        """
+        初始化
+        :param dict conf: 配置(必须内容：host, username, password, database)
+        :param str _section: conf 为空时，读取的配置分组
+        """
+        if aiomysql is None:
+            raise ImportError("No module named 'aiomysql'", 'mysql')
+        if not conf:
+            # 获取 mysql 配置
+            conf = tools.configs(_section = _section)
+        # 只拼接 SQL，不连接数据库
+        self.__builder = MySql(conf, _connect = False)
+        self.__conf = conf
+
+    async def get_pool(self):
+        """
+        获取当前事件循环的连接池
+        :return:
+        :rtype: aiomysql.Pool
+        """
+        conf = self.__conf
+        loop = asyncio.get_event_loop()
+        key = (conf['host'], int(conf['port']) if 'port' in conf else 3306, conf['username'], conf['database'],
+               conf['charset'] if 'charset' in conf else 'utf8mb4', id(loop))
+        if key not in _pools:
+            # 并发调用时，只创建一个连接池
+            _pools[key] = asyncio.ensure_future(aiomysql.create_pool(
+                host = conf['host'], port = key[1], user = conf['username'], password = conf['password'],
+                db = conf['database'], charset = key[4],
+                minsize = int(conf['pool_min']) if 'pool_min' in conf else 1,
+                maxsize = int(conf['pool_max']) if 'pool_max' in conf else 10,
+                pool_recycle = int(conf['pool_lifetime']) if 'pool_lifetime' in conf else 3600,
+            ))
+        try:
+            return await _pools[key]
+        except Exception:
+            _pools.pop(key, None)
+            raise
+
+    def select(self, _table, _where = None, _key = None, _order = None, _pos = 0):
+        """
+        获取一条数据，参数同 MySql.select
+        :return: False | None | dict
+        :rtype: dict
+        """
+        return self.query_sql(*self.__builder.get_query().select(_table, _where, _key, _order, _pos))
+
+    def selects(self, _table, _order = None, _key = None, _where = None, _group = None):
+        """
+        查询多条数据，参数同 MySql.selects
+        :return: False | None | list
+        :rtype: list
+        """
+        return self.query_sql(*self.__builder.get_query().selects(_table, _order, _key, _where, _group))
+
+    def update(self, _table, _where = None, _param = None, _limit = True):
+        """
+        修改，参数同 MySql.update
+        :return: False | 修改数量
+        :rtype: bool or int
+        """
+        return self.query_sql(*self.__builder.get_query().update(_table, _where, _param, _limit))
+
+    def add(self, _table, _param = None):
+        """
+        添加单条数据，参数同 MySql.add
+        :return: False | 新增id
+        :rtype: bool or int
+        """
+        if not _param:
+            return self.result(False)
+        return self.query_sql(*self.__builder.get_query().add(_table, _param))
+
+    def adds(self, _table, _params = None):
+        """
+        添加多条数据(字段以第一条数据为准)，参数同 MySql.adds
+        :return: False | 新增id(第一条数据的id)
+        :rtype: bool or int
+        """
+        _params = [item for item in _params if isinstance(item, dict)] if _params else []
+        if not _params:
+            return self.result(False)
+        keys = list(_params[0].keys())
+        _type, sql, param, _format = self.__builder.get_query().add(_table, _params[0])
+        rows = [[get_value(item.get(k)) for k in keys] for item in _params]
+
+        return self.query_sql('as', sql, rows)
+
+    def delete(self, _table, _where = None, _limit = True):
+        """
+        删除，参数同 MySql.delete
+        :return: False | 删除数量
+        :rtype: bool or int
+        """
+        return self.query_sql(*self.__builder.get_query().delete(_table, _where, _limit))
+
+    def count(self, _table, _where = None):
+        """
+        数据量统计，参数同 MySql.count
+        :return: 总数据量
+        :rtype: int
+        """
+        return self.get_total(self.__builder.get_query().count(_table, _where))
+
+    def sum(self, _table, _key = None, _where = None):
+        """
+        求和，参数同 MySql.sum
+        :return: 总和
+        :rtype: int
+        """
+        if not _key:
+            return self.result(False)
+        return self.get_total(self.__builder.get_query().sum(_table, _key, _where))
+
+    async def get_total(self, _query):
+        """
+        执行 count、sum
+        :param tuple _query: (执行类型, SQL, 参数, 查询结果格式)
+        :return:
+        :rtype: int
+        """
+        result = await self.query_sql(*_query)
+        return result['total'] if result else 0
+
+    @staticmethod
+    async def result(_result):
+        """
+        直接返回结果(协程)
+        :param _result:
+        :return:
+        """
+        return _result
+
+    def page(self, _page, _count = 10):
+        """
+        分页，同 MySql.page
+        :return:
+        """
+        self.__builder.page(_page, _count)
+        return self
+
+    def row_format(self, _format = 'dict'):
+        """
+        设置 查询结果格式，同 MySql.row_format
+        :return:
+        """
+        self.__builder.row_format(_format)
+        return self
+
+    async def query_sql(self, _type = 's', _sql = '', _param = None, _format = 'dict'):
+        """
+        执行 SQL
+        :param str _type: 执行类型 s -> 查询单条 | se -> 查询多条 | u -> 修改 | a -> 添加 | as -> 批量添加 | d -> 删除
+        :param str _sql: SQL 语句
+        :param list|tuple|None _param: _sql 中占位符 %s 对应的值(批量添加时为多行)
+        :param str _format: 查询结果格式，同 MySql.row_format
+        :return:
+        :rtype: bool, int, list or dict
+        """
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                rows = None
+                start = time.time()
+                try:
+                    if _type == 'as':
+                        rows = await cur.executemany(_sql, _param)
+                    else:
+                        rows = await cur.execute(_sql, _param)
+                    if _type == 's':
+                        # 获取单条数据
+                        data = await cur.fetchone()
+                        result = {}
+                        if data:
+                            columns = [field[0] for field in cur.description]
+                            result = get_rows([data], columns, _format, get_types(cur.description))
+                            result = result if isinstance(result, dict) else result[0]
+                    elif _type == 'se':
+                        # 获取数据
+                        data = await cur.fetchall()
+                        columns = [field[0] for field in cur.description] if cur.description else []
+                        result = get_rows(data, columns, _format,
+                                          get_types(cur.description) if cur.description else None)
+                    elif _type in ('u', 'a', 'as', 'd'):
+                        await conn.commit()
+                        result = cur.lastrowid if _type in ('a', 'as') else rows
+                    else:
+                        result = False
+                except Exception as e:
+                    await conn.rollback()
+                    tools.logs('/mysql/error',
+                               {'file_type': 'mysql', 'message': e, 'sql': _sql},
+                               'error',
+                               _type = 3)
+                    result = False
+                finally:
+                    stats.record('mysql', stats.get_shape(_sql), time.time() - start, rows, len(_sql),
+                                 [_sql, _param if _type != 'as' else len(_param)])
+
+        return result
+
+
+async def close_pools():
+    """
+    关闭当前事件循环的所有连接池
+    :return:
+    """
+    loop_id = id(asyncio.get_event_loop())
+    for key in list(_pools.keys()):
+        if key[-1] != loop_id:
+            continue
+        pool = await _pools.pop(key)
+        pool.close()
+        await pool.wait_closed()
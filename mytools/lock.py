@@ -0,0 +1,149 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+任务锁模块(基于 fcntl.flock 文件锁)
+    - 1、加锁： lock = TaskLock('test/task1'); lock.acquire()
+    - 2、解锁： lock.release()
+    - 3、上下文： with TaskLock('test/task1') as lock: ...
+    - 进程退出时，系统会自动释放文件锁，不会遗留死锁
+    - windows 操作系统中没有 fcntl 模块，加锁始终成功
+"""
+import os
+import json
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# 自定义模块
+from mytools import tools
+
+
+# 锁文件目录
+LOCK_DIR = tools.ROOT_PATH + '/log/lock/'
+
+
+class TaskLock(object):
+    def __init__(self, _name, _timeout = None):
+        """
+        初始化
+        :param str _name: 锁名称(一般为：类名/方法名)
+        :param int or None _timeout: 锁的最长持有时间(单位：秒)，超时视为死锁，允许抢占；默认：不超时
+        """
+        self.name = _name.strip('/').lower()
+        self.path = LOCK_DIR + self.name.replace('/', '.') + '.lock'
+        self.timeout = _timeout
+        self.__fp = None
+
+    def acquire(self):
+        """
+        加锁(非阻塞)
+        :return: True -> 加锁成功 | False -> 已被其他任务锁定
+        :rtype: bool
+        """
+        if self.__fp:
+            return True
+        if fcntl is None:
+            return True
+        tools.mk_dir(self.path)
+        while True:
+            fp = open(self.path, 'a+', encoding = 'utf-8')
+            try:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                ino = os.fstat(fp.fileno()).st_ino
+                fp.close()
+                # 持有时间超时：删除旧锁文件，旧任务持有的锁随之失效
+                if not self.is_stale():
+                    return False
+                self.remove(ino)
+                continue
+            # 加锁期间，锁文件被其他任务删除并重建：重新加锁
+            try:
+                if os.stat(self.path).st_ino != os.fstat(fp.fileno()).st_ino:
+                    fp.close()
+                    continue
+            except FileNotFoundError:
+                fp.close()
+                continue
+            break
+
+        # 记录持有者信息
+        fp.seek(0)
+        fp.truncate()
+        fp.write(json.dumps({
+            'pid': os.getpid(),
+            'create_time': tools.get_date('%Y-%m-%d %H:%M:%S'),
+            'timestamp': int(time.time()),
+        }))
+        fp.flush()
+        self.__fp = fp
+        return True
+
+    def release(self):
+        """
+        解锁
+        :return:
+        """
+        if not self.__fp:
+            return
+        try:
+            # 锁文件已被超时抢占的任务重建时，不删除
+            self.remove(os.fstat(self.__fp.fileno()).st_ino)
+            fcntl.flock(self.__fp.fileno(), fcntl.LOCK_UN)
+        finally:
+            self.__fp.close()
+            self.__fp = None
+
+    def get_owner(self):
+        """
+        获取锁持有者信息
+        :return: {} | {'pid': 进程id, 'create_time': 加锁时间, 'timestamp': 加锁时间戳}
+        :rtype: dict
+        """
+        try:
+            with open(self.path, 'r', encoding = 'utf-8') as fpr:
+                return json.loads(fpr.read())
+        except (OSError, ValueError):
+            return {}
+
+    def is_stale(self):
+        """
+        是否为死锁：持有者进程已不存在 或 持有时间超时
+        :return:
+        :rtype: bool
+        """
+        owner = self.get_owner()
+        if not owner:
+            return False
+        if self.timeout and time.time() - owner['timestamp'] > self.timeout:
+            return True
+        try:
+            os.kill(owner['pid'], 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+
+    def remove(self, _ino = None):
+        """
+        删除锁文件
+        :param int|None _ino: 只删除 inode 为 _ino 的锁文件；默认：不检查
+        :return:
+        """
+        try:
+            if _ino is None or os.stat(self.path).st_ino == _ino:
+                os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        if not self.acquire():
+            raise BlockingIOError('Lock is held by pid {}'.format(self.get_owner().get('pid')), 'lock')
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
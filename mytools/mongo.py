@@ -3,50 +3,472 @@
 import pymongo
 # import sys
 # import json
+import os
+import re
+import json
 import copy
+import time
+import queue
+import atexit
+import threading
+import concurrent.futures
 from bson.son import SON
+from bson import BSON
+from pymongo.errors import BulkWriteError
+from pymongo.write_concern import WriteConcern
 
 # 自定义模块
 from mytools import tools
+from mytools import stats as _stats  # 别名：避免与 stats 方法重名
+
+
+# 客户端(自带连接池，线程安全)：{配置分组: (进程id, pymongo.MongoClient, 配置)}
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(_section):
+    """
+    获取客户端：同一进程内，相同配置分组共享一个 MongoClient，只在创建连接时认证
+    :param str _section: 配置分组
+        - int pool_max: 最大连接数，默认 100
+        - int pool_min: 保留的最少连接数，默认 0
+        - int pool_idle: 空闲连接超时关闭(单位：秒)，默认不关闭
+        - int pool_wait: 连接数已满时，等待空闲连接的时间(单位：秒)，默认一直等待
+        - int connect_timeout: 连接超时(单位：秒)，默认 20
+        - int socket_timeout: 读写超时(单位：秒)，默认不超时
+        - str w, int j, int wtimeout: 默认写关注，同 Mongo.write_concern
+    :return: (客户端, 配置)
+    :rtype: tuple
+    """
+    with _clients_lock:
+        item = _clients.get(_section)
+        # fork 出的子进程不能复用父进程的连接
+        if item is not None and item[0] == os.getpid():
+            return item[1], item[2]
+
+        config = tools.configs(_section = _section)
+        client = pymongo.MongoClient(config['host'], int(config['port']), **get_client_options(config))
+        _clients[_section] = (os.getpid(), client, config)
+
+    return client, config
+
+
+def get_client_options(_config):
+    """
+    获取 客户端参数(认证、连接池、写关注)，同 get_client
+    :param dict _config: 配置
+    :return:
+    :rtype: dict
+    """
+    if int(_config['version'][0:1]) > 2:
+        # mongoDb 3.0+ 版本  ->  SCRAM-SHA-1
+        # mongoDb 4.0+ 版本  ->  SCRAM-SHA-1 or SCRAM-SHA-256
+        mechanism = 'SCRAM-SHA-1'
+    else:
+        # mongoDb pre-3.0 版本  ->  MONGODB-CR
+        mechanism = 'MONGODB-CR'
+    kwargs = {
+        # 通过admin库认证账号权限
+        'username': _config['user'],
+        'password': _config['password'],
+        'authSource': 'admin',
+        'authMechanism': mechanism,
+    }
+    options = {
+        'pool_max': ('maxPoolSize', 1),
+        'pool_min': ('minPoolSize', 1),
+        'pool_idle': ('maxIdleTimeMS', 1000),
+        'pool_wait': ('waitQueueTimeoutMS', 1000),
+        'connect_timeout': ('connectTimeoutMS', 1000),
+        'socket_timeout': ('socketTimeoutMS', 1000),
+        'wtimeout': ('wTimeoutMS', 1),
+    }
+    for k, (name, rate) in options.items():
+        if k in _config:
+            kwargs[name] = int(float(_config[k]) * rate)
+    # 默认写关注：w = 1 | majority，j = 1 -> 写入日志后才返回
+    if 'w' in _config:
+        kwargs['w'] = get_w(_config['w'])
+    if 'j' in _config:
+        kwargs['journal'] = bool(int(_config['j']))
+
+    return kwargs
+
+
+def get_w(_w):
+    """
+    获取 写关注的 w
+    :param str|int _w: 数字 | majority
+    :return:
+    :rtype: int or str
+    """
+    return int(_w) if str(_w).isdigit() else _w
+
+
+def close_all():
+    """
+    关闭当前进程的所有客户端(先写入后台队列中的数据)
+    :return:
+    """
+    close_writers()
+    with _clients_lock:
+        for pid, client, config in _clients.values():
+            if pid == os.getpid():
+                client.close()
+        _clients.clear()
+
+
+def get_pipeline(_order = None, _keys = None, _where = None, _group = None, _skip = 0, _limit = 0):
+    """
+    获取 selects 的聚合条件
+    :param dict or None _order: 排序
+    :param dict or None _keys: 查询字段
+    :param dict or None _where: 查询条件
+    :param dict _group: 分组
+    :param int _skip: 跳过前 n 条
+    :param int _limit: 数据量；0 -> 不限制
+    :return:
+    :rtype: list
+    """
+    pipeline = []
+    if _where:
+        pipeline.append({'$match': _where})
+    if _group:
+        pipeline.append({'$group': _group})
+    # $project 放在 $sort 之后：$sort 紧跟 $match 时才能使用索引
+    if _order:
+        pipeline.append({'$sort': SON([(k, v) for (k, v) in _order.items()])})
+    if _limit:
+        pipeline.append({'$skip': _skip})
+        pipeline.append({'$limit': _limit})
+    if _keys:
+        pipeline.append({'$project': _keys})
+    return pipeline
+
+
+def get_count_pipeline(_where = None, _key = None, _group = None):
+    """
+    获取 count 的聚合条件，参数同 Mongo.count
+    :return:
+    :rtype: list
+    """
+    pipeline = []
+    if _where:
+        pipeline.append({
+            '$match': _where
+        })
+    group1 = {}
+    group2 = None
+    if _key and _group:
+        group2 = {}
+        if isinstance(_group, str):
+            group1['_id'] = _group
+            group2 = '$_id._id'
+        else:
+            group1 = copy.deepcopy(_group)
+            for k in _group:
+                group2[k] = '$_id.' + k
+
+        if isinstance(_key, str):
+            group1[_key] = '$' + _key
+        elif isinstance(_key, list):
+            for item in _key:
+                group1[item] = '$' + str(item)
+        else:
+            # group1 = {**group1, **_key}  # python 3.5 及以上才支持此语法
+            group1.update(_key)
+    elif _key:
+        if isinstance(_key, str):
+            group1 = '$' + _key
+        elif isinstance(_key, list):
+            group1 = {}
+            for item in _key:
+                group1[item] = '$' + str(item)
+        else:
+            group1 = _key
+    elif _group:
+        group2 = _group
+
+    # 去重
+    if group1:
+        pipeline.append({
+            '$group': {
+                '_id': group1,
+            }
+        })
+    # 统计
+    pipeline.append({
+        '$group': {
+            '_id': group2,
+            'total': {'$sum': 1}
+        }
+    })
+    return pipeline
+
+
+def get_count_result(_result, _group = None):
+    """
+    获取 count 的结果
+    :param list _result: 聚合结果
+    :param str|dict|None _group: 分组
+    :return:
+    :rtype: int or list[dict]
+    """
+    if _group:
+        return list(_result)
+    return _result[-1]['total'] if _result else 0
+
+
+def get_sum_pipeline(_where = None, _key = None, _group = None):
+    """
+    获取 sum 的聚合条件，参数同 Mongo.sum
+    :return: None -> _key 格式错误
+    :rtype: list or None
+    """
+    pipeline = []
+    if _where:
+        pipeline.append({
+            '$match': _where
+        })
+    group = {
+        '_id': _group
+    }
+    if isinstance(_key, str):
+        group[_key] = {
+            '$sum': '$' + _key
+        }
+    elif isinstance(_key, list):
+        for item in _key:
+            group[item] = {
+                '$sum': '$' + item
+            }
+    elif isinstance(_key, dict):
+        for k, v in _key.items():
+            group[k] = {
+                '$sum': '$' + v.lstrip('$')
+            }
+    else:
+        return None
+    pipeline.append({
+        '$group': group
+    })
+    return pipeline
+
+
+def get_sum_result(_result, _key, _group = None):
+    """
+    获取 sum 的结果
+    :param list _result: 聚合结果
+    :param str|list|dict _key: 求和字段
+    :param str|dict|None _group: 分组
+    :return:
+    :rtype: int | dict | list[dict]
+    """
+    if _group:
+        return list(_result)
+    elif isinstance(_key, str):
+        return _result[0][_key] if _result else 0
+    return _result[0] if _result else []
+
+
+# 多指标统计的聚合操作：{指标类型: 累加器}
+METRICS_OPERATORS = {'distinct': '$addToSet', 'sum': '$sum', 'min': '$min', 'max': '$max', 'avg': '$avg'}
+
+
+def get_metrics_pipeline(_where = None, _group = None, _metrics = None):
+    """
+    获取 多指标统计的聚合条件，参数同 Mongo.stats
+    - 去重计数：$addToSet 后取 $size (每组的去重值需小于 16M)
+    :return: None -> _metrics 格式错误
+    :rtype: list or None
+    """
+    if not _metrics or not isinstance(_metrics, dict):
+        return None
+    pipeline = []
+    if _where:
+        pipeline.append({
+            '$match': _where
+        })
+    group = {
+        '_id': _group
+    }
+    sizes = {}
+    for name, metric in _metrics.items():
+        if metric == 'count':
+            group[name] = {'$sum': 1}
+            continue
+        if not isinstance(metric, (list, tuple)) or len(metric) != 2 or metric[0] not in METRICS_OPERATORS:
+            return None
+        group[name] = {METRICS_OPERATORS[metric[0]]: '$' + str(metric[1]).lstrip('$')}
+        if metric[0] == 'distinct':
+            sizes[name] = {'$size': '$' + name}
+    pipeline.append({
+        '$group': group
+    })
+    if sizes:
+        pipeline.append({
+            '$addFields': sizes
+        })
+    return pipeline
+
+
+def get_metrics_result(_result, _group = None, _metrics = None):
+    """
+    获取 多指标统计的结果，参数同 Mongo.stats
+    :param list _result: 聚合结果
+    :return:
+    :rtype: dict | list[dict]
+    """
+    if _group:
+        return list(_result)
+    elif _result:
+        row = _result[0]
+        row.pop('_id', None)
+        return row
+    # 无数据：计数、求和为 0
+    return dict((k, 0 if v == 'count' or v[0] in ('distinct', 'sum') else None) for k, v in _metrics.items())
+
+
+def get_rows(_rows, _format = 'dict'):
+    """
+    转换 查询结果格式
+    :param list[dict] _rows:
+    :param str _format: 格式，同 Mongo.row_format
+    :return:
+    :rtype: list or dict
+    """
+    if _format == 'dict':
+        return _rows
+    columns = tools.list_columns(_rows)
+    if _format == 'column':
+        return columns
+    return tools.array_columns(columns, None, _format)
+
+
+# 分组结果的合并方式：{累加器: 合并方式}
+MERGE_ACCUMULATORS = {'$sum': 'sum', '$min': 'min', '$max': 'max', '$addToSet': 'union'}
+
+
+def get_merge_spec(_pipeline):
+    """
+    根据聚合条件中最后一个 $group 获取 各字段的合并方式，不能合并的字段不返回
+    - $sum -> sum | $min -> min | $max -> max | $addToSet -> union
+    - $avg、$first 等，以及之后被 $addFields、$set、$project 改写的字段(如：去重计数的 $size)不能合并
+    - 跟在另一个 $group 后的 {'$sum': 1} 是 去重后的数量，不能合并(如：count 指定 _key 时)
+    :param list _pipeline: 聚合条件
+    :return: {字段: 合并方式}
+    :rtype: dict
+    """
+    spec = None
+    for stage in _pipeline:
+        if not isinstance(stage, dict):
+            continue
+        if '$group' in stage:
+            after_group = spec is not None
+            spec = {}
+            for k, v in stage['$group'].items():
+                if k == '_id' or not isinstance(v, dict) or len(v) != 1:
+                    continue
+                op, value = list(v.items())[0]
+                if op not in MERGE_ACCUMULATORS or (after_group and op == '$sum' and not isinstance(value, str)):
+                    continue
+                spec[k] = MERGE_ACCUMULATORS[op]
+        elif spec:
+            for op in ('$addFields', '$set', '$project'):
+                for k, v in stage.get(op, {}).items():
+                    if op != '$project' or v not in (1, True):
+                        spec.pop(k, None)
+
+    return spec if spec else {}
+
+
+def merge_groups(_results, _spec):
+    """
+    合并多个集合的分组结果：_id 相同的行，按 _spec 合并各字段
+    :param list|iterable _results: 各集合的聚合结果 [[{'_id':, 字段: 值}, ...], ...]
+    :param dict _spec: 各字段的合并方式 {字段: sum | min | max | union}，同 get_merge_spec
+    :return: 按 _id 首次出现的顺序
+    :rtype: list[dict]
+    """
+    merged = {}
+    for rows in _results:
+        for row in rows:
+            for k in row:
+                if k != '_id' and k not in _spec:
+                    raise ValueError('Field \'' + str(k) + '\' can not be merged', 'mongo')
+            key = json.dumps(row.get('_id'), sort_keys = True, default = str)
+            item = merged.get(key)
+            if item is None:
+                merged[key] = dict(row)
+                continue
+            for k, v in row.items():
+                if k == '_id' or v is None:
+                    continue
+                old = item.get(k)
+                if old is None:
+                    item[k] = v
+                elif _spec[k] == 'sum':
+                    item[k] = old + v
+                elif _spec[k] == 'min':
+                    item[k] = min(old, v)
+                elif _spec[k] == 'max':
+                    item[k] = max(old, v)
+                elif _spec[k] == 'union':
+                    item[k] = old + [x for x in v if x not in old]
+
+    return list(merged.values())
+
+
+def is_simple_keys(_keys):
+    """
+    投影是否只包含 1/0 (find() 可用)
+    :param dict _keys: 投影
+    :return:
+    :rtype: bool
+    """
+    for v in _keys.values():
+        if isinstance(v, bool) or v in (0, 1):
+            continue
+        return False
+    return True
 
 
 class Mongo(object):
-    def __init__(self, _localhost = None, _has_db = None):
+    def __init__(self, _localhost = None, _has_db = None, _section = None):
         """
         初始化
         :param bool _localhost: true -> 本地数据库 | false -> 外网数据库
         :param bool _has_db: true -> 检查库不存在,不自动建库 | false -> 不检查库存在,不存在时自动建库
+        :param str|None _section: 配置分组(优先于 _localhost)
         """
         # 读取 mongo 配置
         _localhost = True if _localhost is None else _localhost
         _has_db = True if _has_db is None else _has_db
-        _section = 'mongo' if _localhost else 'mongo2'
-        config = tools.configs(_section = _section)
-        self.__user = config['user']
-        self.__pwd = config['password']
-        self.__version = config['version']
+        if not _section:
+            _section = 'mongo' if _localhost else 'mongo2'
+        try:
+            # 连接 mongoDb：共享客户端
+            self.__conn, config = get_client(_section)
+        except Exception as e:
+            e.args += ('mongo',)
+            raise
         self.__hasDb = _has_db
         self.__skip = 0  # 跳过前 n 条
         self.__limit = 0  # 每次查询数据量
+        self.__format = 'dict'  # 查询结果格式
+        self.__hint = None  # 指定索引
+        self.__max_time = 0  # 最长执行时间(单位：毫秒)
+        self.__section = _section
+        self.__pool_max = int(config['pool_max']) if 'pool_max' in config else 100  # 客户端最大连接数
+        self.__concern = None  # 下一次写入的写关注
+        self.__concerns = {}  # 集合的写关注：{表: WriteConcern}
+        # 库、集合名称缓存(单位：秒)：只缓存存在的名称，未命中时重新查询
+        self.__catalog_ttl = int(config['catalog_ttl']) if 'catalog_ttl' in config else 60
+        self.__databases = None  # [获取时间, {数据库}]
+        self.__collections = {}  # {数据库: [获取时间, {集合}]}
         self.check = False
         self.err = {}
-        try:
-            # 连接 mongoDb
-            self.__conn = pymongo.MongoClient(config['host'], int(config['port']))
-            # 连接系统默认数据库admin
-            db = self.__conn.admin
-            if int(self.__version[0:1]) > 2:
-                # mongoDb 3.0+ 版本  ->  SCRAM-SHA-1
-                # mongoDb 4.0+ 版本  ->  SCRAM-SHA-1 or SCRAM-SHA-256
-                mechanism = 'SCRAM-SHA-1'
-            else:
-                # mongoDb pre-3.0 版本  ->  MONGODB-CR
-                mechanism = 'MONGODB-CR'
-            # 通过admin库认证账号权限
-            db.authenticate(self.__user, self.__pwd, mechanism = mechanism)
-        except Exception as e:
-            e.args += ('mongo',)
-            raise
 
     def set_default(self):
         """
@@ -55,18 +477,62 @@ class Mongo(object):
         """
         self.__skip = 0  # 跳过前 n 条
         self.__limit = 0  # 每次查询数据量
+        self.__format = 'dict'  # 查询结果格式
+        self.__hint = None  # 指定索引
+        self.__max_time = 0  # 最长执行时间(单位：毫秒)
+        self.__concern = None  # 下一次写入的写关注
 
-    def set_col(self, _table):
+    def set_col(self, _table, _write = False):
         """
         选择集合
         :param str _table:
+        :param bool _write: 是否用于写入(使用 write_concern 设置的写关注)
         :return: class Mongo
         """
+        concern = self.__concern if self.__concern else self.__concerns.get(_table)
         _table = self.get_table(_table)
         if not _table:
             exit()
-        return self.__conn[_table[0]][_table[1]]
+        conn_col = self.__conn[_table[0]][_table[1]]
+        if _write and concern:
+            conn_col = conn_col.with_options(write_concern = concern)
+        return conn_col
 
+    def write_concern(self, _w = None, _j = None, _wtimeout = None, _table = None):
+        """
+        设置 写关注
+        - 例子：重要数据 db.write_concern('majority').add(...)；日志数据 db.write_concern(0, _table = 'log.request')
+        :param int|str|None _w: 0 -> 不等待确认 | 1 -> 主节点确认 | majority -> 多数节点确认
+        :param bool|None _j: 是否写入日志后才返回
+        :param int|None _wtimeout: 等待确认的超时时间(单位：毫秒)
+        :param str|None _table: 表；为空时只对下一次写入生效，否则对该集合的所有写入生效
+        :return:
+        """
+        kwargs = {}
+        if _w is not None:
+            kwargs['w'] = get_w(_w)
+        if _j is not None:
+            kwargs['j'] = bool(_j)
+        if _wtimeout is not None:
+            kwargs['wtimeout'] = int(_wtimeout)
+        concern = WriteConcern(**kwargs)
+        if _table:
+            self.__concerns[_table] = concern
+        else:
+            self.__concern = concern
+        return self
+
+    def add_background(self, _table, _param):
+        """
+        后台添加单条数据：放入后台队列，由后台线程批量写入(不等待写入结果，适合日志等非重要数据)
+        :param str _table: 表
+        :param dict _param: 要添加的数据
+        :return: True -> 已放入队列 | False -> 队列已满，丢弃
+        :rtype: bool
+        """
+        return get_writer(self.__section).put(_table, _param)
+
+    @_stats.watch('mongo', '_where')
     def select(self, _table, _where = None, _keys = None, _order = None):
         """
         获取单条数据
@@ -79,20 +545,12 @@ class Mongo(object):
         """
         # 选择集合
         conn_col = self.set_col(_table)
-        # 查询条件
-        pipeline = []
-        if _where:
-            pipeline.append({'$match': _where})
-        if _order:
-            pipeline.append({'$sort': SON([(k, v) for (k, v) in _order.items()])})
-        pipeline.append({'$skip': 0})
-        pipeline.append({'$limit': 1})
-        if _keys:
-            pipeline.append({'$project': _keys})
         res = {}
         try:
             # 查询结果
-            result = conn_col.aggregate(pipeline)
+            self.__skip = 0
+            self.__limit = 1
+            result = self.get_cursor(conn_col, _order, _keys, _where)
             for r in result:
                 res = r
         except Exception as e:
@@ -102,6 +560,7 @@ class Mongo(object):
         self.set_default()
         return res
 
+    @_stats.watch('mongo', '_where')
     def selects(self, _table, _order = None, _keys = None, _where = None, _group = None):
         """
         获取多条数据
@@ -116,25 +575,13 @@ class Mongo(object):
         # 选择集合
         conn_col = self.set_col(_table)
 
-        # 查询条件
-        pipeline = []
-        if _where:
-            pipeline.append({'$match': _where})
-        if _group:
-            pipeline.append({'$group': _group})
-        if _order:
-            pipeline.append({'$sort': SON([(k, v) for (k, v) in _order.items()])})
-        if self.__limit:
-            pipeline.append({'$skip': self.__skip})
-            pipeline.append({'$limit': self.__limit})
-        if _keys:
-            pipeline.append({'$project': _keys})
         res = []
         try:
             # 查询结果
-            result = conn_col.aggregate(pipeline)
+            result = self.get_cursor(conn_col, _order, _keys, _where, _group)
             for r in result:
                 res.append(r)
+            res = self.get_rows(res)
         except Exception as e:
             print(e)
             res = False
@@ -142,6 +589,170 @@ class Mongo(object):
         self.set_default()
         return res
 
+    def iselects(self, _table, _order = None, _keys = None, _where = None, _group = None, _batch = None,
+                 _disk = False):
+        """
+        流式获取多条数据：逐批读取游标，内存占用与数据量无关
+        :param str _table: 表
+        :param dict or None _order: 排序
+        :param dict or None _keys: 查询字段(只含 1/0 时由 find() 在服务端投影，减少传输的数据量)
+        :param dict or None _where: 查询条件
+        :param dict _group: 分组
+        :param int or None _batch: 每批数据量 None -> 逐条返回 dict | int -> 每次返回一批(格式同 row_format)
+        :param bool _disk: 是否允许使用磁盘(排序、分组超出内存限制时)
+        :return: 生成器
+        :rtype: generator
+        """
+        _format = self.__format
+        if _format != 'dict' and not _batch:
+            self.set_default()
+            raise ValueError("Param '_batch' can not be empty when _format is " + _format, 'mongo')
+        # 选择集合
+        conn_col = self.set_col(_table)
+        cursor = self.get_cursor(conn_col, _order, _keys, _where, _group, _batch if _batch else 1000, _disk)
+        self.set_default()
+
+        return self.__iterate(cursor, conn_col.full_name + '.iselects', _where, _batch, _format)
+
+    def iaggregate(self, _table, _pipeline, _batch = None, _disk = False):
+        """
+        流式聚合操作
+        :param str _table: 表
+        :param list _pipeline: 聚合条件
+        :param int or None _batch: 每批数据量 None -> 逐条返回 dict | int -> 每次返回一批(格式同 row_format)
+        :param bool _disk: 是否允许使用磁盘(排序、分组超出内存限制时)
+        :return: 生成器
+        :rtype: generator
+        """
+        _format = self.__format
+        kwargs = self.get_options()
+        self.set_default()
+        if not _pipeline:
+            raise ValueError("Param '_pipeline' can not be empty", 'mongo')
+        if _format != 'dict' and not _batch:
+            raise ValueError("Param '_batch' can not be empty when _format is " + _format, 'mongo')
+        # 选择集合
+        conn_col = self.set_col(_table)
+        cursor = conn_col.aggregate(_pipeline, allowDiskUse = bool(_disk), batchSize = _batch if _batch else 1000,
+                                    **kwargs)
+
+        return self.__iterate(cursor, conn_col.full_name + '.iaggregate', _pipeline, _batch, _format)
+
+    def __iterate(self, _cursor, _name, _query, _batch, _format):
+        """
+        逐批读取游标
+        :param _cursor: 游标
+        :param str _name: 统计名称(库.集合.方法)
+        :param dict|list _query: 查询条件 或 聚合条件
+        :param int or None _batch: 每批数据量
+        :param str _format: 查询结果格式
+        :return: 生成器
+        :rtype: generator
+        """
+        total = 0
+        start = time.time()
+        cursor = _cursor
+        try:
+            if not _batch:
+                for r in cursor:
+                    total += 1
+                    yield r
+                return
+            rows = []
+            for r in cursor:
+                rows.append(r)
+                if len(rows) >= _batch:
+                    total += len(rows)
+                    yield self.get_rows(rows, _format)
+                    rows = []
+            if rows:
+                total += len(rows)
+                yield self.get_rows(rows, _format)
+        finally:
+            cursor.close()
+            # 耗时统计(包括调用方处理数据的时间)
+            _stats.record('mongo', '{} {}'.format(_name, _stats.get_mongo_shape(_query)), time.time() - start, total,
+                         _detail = _query)
+
+    def get_cursor(self, _conn_col, _order = None, _keys = None, _where = None, _group = None, _batch = None,
+                   _disk = False):
+        """
+        获取 select、selects 的游标：未分组且投影不含表达式时使用 find()，否则使用聚合
+        :param _conn_col: 集合
+        :param dict or None _order: 排序
+        :param dict or None _keys: 查询字段
+        :param dict or None _where: 查询条件
+        :param dict _group: 分组
+        :param int or None _batch: 每批数据量
+        :param bool _disk: 是否允许使用磁盘(只对聚合有效)
+        :return:
+        :rtype: pymongo.cursor.Cursor or pymongo.command_cursor.CommandCursor
+        """
+        kwargs = self.get_options()
+        if _group or (_keys and not is_simple_keys(_keys)):
+            if _batch:
+                kwargs['batchSize'] = _batch
+            if _disk:
+                kwargs['allowDiskUse'] = True
+            return _conn_col.aggregate(self.get_pipeline(_order, _keys, _where, _group), **kwargs)
+
+        cursor = _conn_col.find(_where if _where else {}, _keys if _keys else None)
+        if _order:
+            cursor = cursor.sort([(k, v) for (k, v) in _order.items()])
+        if self.__limit:
+            cursor = cursor.skip(self.__skip).limit(self.__limit)
+        if 'hint' in kwargs:
+            cursor = cursor.hint(kwargs['hint'])
+        if 'maxTimeMS' in kwargs:
+            cursor = cursor.max_time_ms(kwargs['maxTimeMS'])
+        if _batch:
+            cursor = cursor.batch_size(_batch)
+        return cursor
+
+    def get_options(self):
+        """
+        获取 查询选项：hint、maxTimeMS
+        :return:
+        :rtype: dict
+        """
+        kwargs = {}
+        if self.__hint:
+            kwargs['hint'] = self.__hint
+        if self.__max_time:
+            kwargs['maxTimeMS'] = self.__max_time
+        return kwargs
+
+    def hint(self, _index):
+        """
+        指定索引(只对下一次查询生效)
+        :param str|dict _index: 索引名 | {字段: 1 | -1}
+        :return:
+        """
+        self.__hint = [(k, v) for (k, v) in _index.items()] if isinstance(_index, dict) else _index
+        return self
+
+    def max_time_ms(self, _ms):
+        """
+        设置 最长执行时间(只对下一次查询生效)，超时报错
+        :param int _ms: 毫秒
+        :return:
+        """
+        self.__max_time = int(_ms)
+        return self
+
+    def get_pipeline(self, _order = None, _keys = None, _where = None, _group = None):
+        """
+        获取 selects 的聚合条件
+        :param dict or None _order: 排序
+        :param dict or None _keys: 查询字段
+        :param dict or None _where: 查询条件
+        :param dict _group: 分组
+        :return:
+        :rtype: list
+        """
+        return get_pipeline(_order, _keys, _where, _group, self.__skip, self.__limit)
+
+    @_stats.watch('mongo')
     def add(self, _table, _param):
         """
         添加单条数据
@@ -151,7 +762,7 @@ class Mongo(object):
         :rtype: bool or str
         """
         # 选择集合
-        conn_col = self.set_col(_table)
+        conn_col = self.set_col(_table, True)
         try:
             result = conn_col.insert_one(_param)
             result = result.inserted_id
@@ -163,6 +774,7 @@ class Mongo(object):
         self.set_default()
         return result
 
+    @_stats.watch('mongo')
     def adds(self, _table, _params):
         """
         添加单条数据
@@ -172,7 +784,7 @@ class Mongo(object):
         :rtype: bool or list
         """
         # 选择集合
-        conn_col = self.set_col(_table)
+        conn_col = self.set_col(_table, True)
         try:
             result = conn_col.insert_many(_params)
             result = result.inserted_ids
@@ -184,6 +796,38 @@ class Mongo(object):
         self.set_default()
         return result
 
+    def bulk(self, _table, _ops, _chunk = 1000, _bytes = 16777216, _callback = None):
+        """
+        批量写入：分批 bulk_write(ordered = False)，某条操作失败不影响其他操作
+        :param str _table: 表
+        :param list|iterable _ops: 操作，同 BulkWriter.add
+        :param int _chunk: 每批最多操作数
+        :param int _bytes: 每批最大字节数
+        :param function _callback: 每批写入后回调，同 BulkWriter
+        :return: {'chunks': 批数, 'ops': 操作数, 'inserted':, 'matched':, 'modified':, 'upserted':, 'deleted':,
+                  'errors': [{'chunk': 批次, 'index': 批内序号, 'code': 错误码, 'errmsg': 错误信息}]}
+        :rtype: dict
+        """
+        with self.bulk_writer(_table, _chunk, _bytes, _callback) as writer:
+            for op in _ops:
+                writer.add(op)
+
+        self.set_default()
+        return writer.result
+
+    def bulk_writer(self, _table, _chunk = 1000, _bytes = 16777216, _callback = None):
+        """
+        获取 批量写入对象(累计操作，满一批自动写入，退出 with 时写入剩余操作)
+        :param str _table: 表
+        :param int _chunk: 每批最多操作数
+        :param int _bytes: 每批最大字节数
+        :param function _callback: 每批写入后回调
+        :return:
+        :rtype: BulkWriter
+        """
+        return BulkWriter(self, _table, _chunk, _bytes, _callback)
+
+    @_stats.watch('mongo', '_where')
     def update(self, _table, _where, _param, _limit = None):
         """
         修改
@@ -195,7 +839,7 @@ class Mongo(object):
         :rtype: bool or int
         """
         # 选择集合
-        conn_col = self.set_col(_table)
+        conn_col = self.set_col(_table, True)
         if '$set' not in _param and '$unset' not in _param:
             print("Miss '$set' or '$unset'")
             self.set_default()
@@ -206,8 +850,8 @@ class Mongo(object):
                 result = conn_col.update_one(_where, _param)
             else:
                 result = conn_col.update_many(_where, _param)
-            # 返回修改数量
-            result = result.modified_count
+            # 返回修改数量(不等待确认时，返回 True)
+            result = result.modified_count if result.acknowledged else True
         except Exception as e:
             # 修改数据失败
             print(e)
@@ -216,6 +860,7 @@ class Mongo(object):
         self.set_default()
         return result
 
+    @_stats.watch('mongo', '_where')
     def delete(self, _table, _where, _limit = None):
         """
         删除
@@ -226,15 +871,15 @@ class Mongo(object):
         :rtype: bool or int
         """
         # 选择集合
-        conn_col = self.set_col(_table)
+        conn_col = self.set_col(_table, True)
         try:
             _limit = True if _limit is None else _limit
             if _limit:
                 result = conn_col.delete_one(_where)
             else:
                 result = conn_col.delete_many(_where)
-            # 返回删除数量
-            result = result.deleted_count
+            # 返回删除数量(不等待确认时，返回 True)
+            result = result.deleted_count if result.acknowledged else True
         except Exception as e:
             # 删除数据失败
             print(e)
@@ -243,6 +888,7 @@ class Mongo(object):
         self.set_default()
         return result
 
+    @_stats.watch('mongo', '_pipeline')
     def aggregate(self, _table, _pipeline):
         """
         聚合操作
@@ -259,10 +905,11 @@ class Mongo(object):
         conn_col = self.set_col(_table)
         try:
             # 查询结果
-            result = conn_col.aggregate(_pipeline)
+            result = conn_col.aggregate(_pipeline, **self.get_options())
             res = []
             for r in result:
                 res.append(r)
+            res = self.get_rows(res)
         except Exception as e:
             print(e)
             res = False
@@ -270,6 +917,7 @@ class Mongo(object):
         self.set_default()
         return res
 
+    @_stats.watch('mongo', '_where')
     def count(self, _table, _where = None, _key = None, _group = None):
         """
         计数
@@ -284,71 +932,13 @@ class Mongo(object):
         conn_col = self.set_col(_table)
 
         # 查询条件
-        pipeline = []
-        if _where:
-            pipeline.append({
-                '$match': _where
-            })
-        group1 = {}
-        group2 = None
-        if _key and _group:
-            group2 = {}
-            if isinstance(_group, str):
-                group1['_id'] = _group
-                group2 = '$_id._id'
-            else:
-                group1 = copy.deepcopy(_group)
-                for k in _group:
-                    group2[k] = '$_id.' + k
-
-            if isinstance(_key, str):
-                group1[_key] = '$' + _key
-            elif isinstance(_key, list):
-                for item in _key:
-                    group1[item] = '$' + str(item)
-            else:
-                # group1 = {**group1, **_key}  # python 3.5 及以上才支持此语法
-                group1.update(_key)
-        elif _key:
-            if isinstance(_key, str):
-                group1 = '$' + _key
-            elif isinstance(_key, list):
-                group1 = {}
-                for item in _key:
-                    group1[item] = '$' + str(item)
-            else:
-                group1 = _key
-        elif _group:
-            group2 = _group
-
-        # 去重
-        if group1:
-            pipeline.append({
-                '$group': {
-                    '_id': group1,
-                }
-            })
-        # 统计
-        pipeline.append({
-            '$group': {
-                '_id': group2,
-                'total': {'$sum': 1}
-            }
-        })
+        pipeline = get_count_pipeline(_where, _key, _group)
         if self.check:
             self.check = False
             return pipeline
         try:
             # 查询结果
-            result = conn_col.aggregate(pipeline)
-            if not _group:
-                res = 0
-                for r in result:
-                    res = r['total']
-            else:
-                res = []
-                for r in result:
-                    res.append(r)
+            res = get_count_result(list(conn_col.aggregate(pipeline, **self.get_options())), _group)
         except Exception as e:
             print(e)
             res = False
@@ -356,6 +946,7 @@ class Mongo(object):
         self.set_default()
         return res
 
+    @_stats.watch('mongo', '_where')
     def distinct(self, _table, _key = None, _where = None):
         """
         去重
@@ -380,6 +971,7 @@ class Mongo(object):
         self.set_default()
         return res
 
+    @_stats.watch('mongo', '_where')
     def sum(self, _table, _key, _where = None, _group = None):
         """
         求和
@@ -392,44 +984,12 @@ class Mongo(object):
         """
         # 选择集合
         conn_col = self.set_col(_table)
-        pipeline = []
-        if _where:
-            pipeline.append({
-                '$match': _where
-            })
-        group = {
-            '_id': _group
-        }
-        if isinstance(_key, str):
-            group[_key] = {
-                '$sum': '$' + _key
-            }
-        elif isinstance(_key, list):
-            for item in _key:
-                group[item] = {
-                    '$sum': '$' + item
-                }
-        elif isinstance(_key, dict):
-            for k, v in _key.items():
-                group[k] = {
-                    '$sum': '$' + v.lstrip('$')
-                }
-        else:
+        pipeline = get_sum_pipeline(_where, _key, _group)
+        if pipeline is None:
             print("Param '_key' can not be empty, and its form should be str, list or dict")
             return False
-        pipeline.append({
-            '$group': group
-        })
         try:
-            result = list(conn_col.aggregate(pipeline))
-            if _group:
-                res = []
-                for r in result:
-                    res.append(r)
-            elif isinstance(_key, str):
-                res = result[0][_key] if result else 0
-            else:
-                res = result[0] if result else []
+            res = get_sum_result(list(conn_col.aggregate(pipeline, **self.get_options())), _key, _group)
         except Exception as e:
             print(e)
             res = False
@@ -437,6 +997,42 @@ class Mongo(object):
         self.set_default()
         return res
 
+    @_stats.watch('mongo', '_where')
+    def stats(self, _table, _where = None, _group = None, _metrics = None):
+        """
+        多指标统计：一次聚合同时计算多个 计数、去重计数、求和、最小值、最大值
+        - 例子：db.stats('log.request', {'type': 1}, '$day', {'total': 'count', 'users': ('distinct', 'uid'),
+                                                             'amount': ('sum', 'amount'), 'first': ('min', 'time')})
+        :param str _table: 表
+        :param dict|None _where: 查询条件
+        :param str|dict|None _group: 分组，同 sum
+        :param dict _metrics: 指标 {名称: count | (distinct | sum | min | max | avg, 字段)}
+            - 无数据时 count、distinct、sum 为 0，min、max、avg 为 None
+        :return: False | 未分组 -> {名称: 值} | 分组 -> [{'_id': 分组, 名称: 值}]
+        :rtype: bool, dict or list[dict]
+        """
+        pipeline = get_metrics_pipeline(_where, _group, _metrics)
+        if pipeline is None:
+            print("Param '_metrics' can not be empty, and its form should be {name: count | (op, key)}")
+            self.set_default()
+            return False
+        if self.check:
+            self.check = False
+            return pipeline
+        # 选择集合
+        conn_col = self.set_col(_table)
+        try:
+            res = get_metrics_result(list(conn_col.aggregate(pipeline, **self.get_options())), _group, _metrics)
+        except Exception as e:
+            print(e)
+            res = False
+
+        self.set_default()
+        return res
+
+    # 别名
+    metrics = stats
+
     def has_database(self, _db_name):
         """
         判断 数据库是否存在
@@ -448,11 +1044,12 @@ class Mongo(object):
         if not isinstance(_db_name, str):
             print("Param '_db_name' is not a string")
             return False
-        db_lists = self.__conn.list_database_names()
-        if _db_name in db_lists:
-            return True
+        now = time.time()
+        if self.__databases is None or now - self.__databases[0] > self.__catalog_ttl or \
+                _db_name not in self.__databases[1]:
+            self.__databases = [now, set(self.__conn.list_database_names())]
 
-        return False
+        return _db_name in self.__databases[1]
 
     def list_databases(self, _empty = None):
         """
@@ -497,6 +1094,7 @@ class Mongo(object):
 
         try:
             self.__conn.drop_database(_db_name)
+            self.clear_catalog(_db_name)
             result = True
         except Exception as e:
             # 删除数据库失败
@@ -517,12 +1115,26 @@ class Mongo(object):
         if not _table:
             print("Miss collection")
             return False
-        conn_db = self.__conn[_table[0]]
-        col_lists = conn_db.list_collection_names()
-        if _table[1] in col_lists:
-            return True
+        now = time.time()
+        cache = self.__collections.get(_table[0])
+        if cache is None or now - cache[0] > self.__catalog_ttl or _table[1] not in cache[1]:
+            cache = self.__collections[_table[0]] = [now, set(self.__conn[_table[0]].list_collection_names())]
 
-        return False
+        return _table[1] in cache[1]
+
+    def clear_catalog(self, _db_name = None):
+        """
+        清除 库、集合名称缓存
+        :param str|None _db_name: 数据库；默认：全部
+        :return:
+        """
+        if _db_name is None:
+            self.__databases = None
+            self.__collections = {}
+            return
+        if self.__databases:
+            self.__databases[1].discard(_db_name)
+        self.__collections.pop(_db_name, None)
 
     def list_collections(self, _db_name):
         """
@@ -543,6 +1155,57 @@ class Mongo(object):
 
         return col_lists
 
+    def scan(self, _db_name, _pattern, _pipeline, _workers = 10, _merge = True):
+        """
+        多集合并行聚合：对名称匹配的所有集合执行相同的聚合，线程数不超过客户端最大连接数
+        - 例子：按天分表的日志，统计每种状态的数量
+            db.scan('log', r'^request_2024', mongo.get_count_pipeline({'type': 1}, None, 'status'))
+        :param str _db_name: 数据库
+        :param str _pattern: 集合名称的正则表达式
+        :param list _pipeline: 聚合条件
+        :param int _workers: 最大线程数
+        :param bool|dict _merge: 是否合并结果(同 merge_groups)
+            - True -> 按最后一个 $group 的累加器合并(同 get_merge_spec)，含不能合并的字段时返回 False
+            - dict -> 指定各字段的合并方式 {字段: sum | min | max | union}
+        :return: False -> 任一集合失败 | 合并后的结果 | {数据库.集合: 结果}
+        :rtype: bool, list or dict
+        """
+        kwargs = self.get_options()
+        self.set_default()
+        if not _pipeline:
+            print("Param '_pipeline' can not be empty")
+            return False
+        pattern = re.compile(_pattern)
+        tables = [table for table in self.list_collections(_db_name) if pattern.search(table.split('.', 1)[1])]
+        if not tables:
+            return [] if _merge else {}
+
+        def call(_table):
+            start = time.time()
+            rows = []
+            try:
+                rows = list(self.__conn[_db_name][_table.split('.', 1)[1]].aggregate(_pipeline, **kwargs))
+                res = rows
+            except Exception as e:
+                print(e)
+                res = False
+            _stats.record('mongo', '{}.scan {}'.format(_table, _stats.get_mongo_shape(_pipeline)), time.time() - start,
+                         len(rows), _detail = _pipeline)
+            return res
+
+        workers = max(min(_workers, self.__pool_max, len(tables)), 1)
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            result = dict(zip(tables, executor.map(call, tables)))
+        if not _merge:
+            return result
+        if any(item is False for item in result.values()):
+            return False
+        try:
+            return merge_groups(result.values(), _merge if isinstance(_merge, dict) else get_merge_spec(_pipeline))
+        except ValueError as e:
+            print(e)
+            return False
+
     def drop_collection(self, _table):
         """
         删除集合
@@ -554,6 +1217,7 @@ class Mongo(object):
         conn_col = self.set_col(_table)
         try:
             conn_col.drop()
+            self.__collections.pop(conn_col.database.name, None)
             result = True
         except Exception as e:
             # 删除集合失败
@@ -681,6 +1345,7 @@ class Mongo(object):
         conn_col = self.set_col(_table)
         try:
             res = conn_col.rename(_new_name)
+            self.__collections.pop(conn_col.database.name, None)
         except Exception as e:
             print(e)
             res = False
@@ -720,6 +1385,31 @@ class Mongo(object):
             self.__limit = _count
         return self
 
+    def row_format(self, _format = 'dict'):
+        """
+        设置 selects、aggregate 查询结果格式(只对下一次查询生效)
+        :param str _format: 格式
+            - dict -> list[dict] (默认)
+            - column -> {字段: list} (按列返回，缺少的字段为 None)
+            - array -> {字段: array.array} (数值列为 int64/float64 数组，其他列为 list)
+            - numpy -> {字段: numpy.ndarray} (需安装 numpy)
+        :return:
+        """
+        if _format not in ('dict', 'column', 'array', 'numpy'):
+            raise ValueError("Param '_format' must be one of dict, column, array, numpy", 'mongo')
+        self.__format = _format
+        return self
+
+    def get_rows(self, _rows, _format = None):
+        """
+        转换 查询结果格式
+        :param list[dict] _rows:
+        :param str|None _format: 格式；默认：row_format 设置的格式
+        :return:
+        :rtype: list or dict
+        """
+        return get_rows(_rows, _format if _format else self.__format)
+
     def get_error(self):
         """
         获取报错
@@ -730,10 +1420,327 @@ class Mongo(object):
 
     def close_db(self):
         """
-        关闭 Mongo
+        关闭 Mongo：客户端为进程内共享，不关闭连接(进程结束前可调用 mongo.close_all())
         """
-        self.__conn.close()
+        self.set_default()
 
     def get_sql(self):
         self.check = True
         return self
+
+
+class BulkWriter(object):
+    def __init__(self, _mongo, _table, _chunk = 1000, _bytes = 16777216, _callback = None):
+        """
+        批量写入：累计操作，按数量 或 字节数分批 bulk_write(ordered = False)
+        - 某条操作失败不影响同批其他操作，失败信息记录在 result['errors']
+        - 例子：
+            with db.bulk_writer('db.col') as writer:
+                writer.upsert({'uid': 1}, {'$set': {'name': 'a'}})
+            print(writer.result)
+        :param Mongo _mongo:
+        :param str _table: 表
+        :param int _chunk: 每批最多操作数
+        :param int _bytes: 每批最大字节数(BSON)
+        :param function _callback: 每批写入后回调 _callback({'chunk':, 'ops':, 'inserted':, ..., 'errors': []})
+        """
+        self.table = _table
+        self.__col = _mongo.set_col(_table, True)
+        self.__chunk = max(int(_chunk), 1)
+        self.__bytes = int(_bytes)
+        self.__callback = _callback
+        self.__ops = []
+        self.__size = 0
+        self.result = {'chunks': 0, 'ops': 0, 'inserted': 0, 'matched': 0, 'modified': 0, 'upserted': 0,
+                       'deleted': 0, 'errors': []}
+
+    def add(self, _op):
+        """
+        添加操作
+        :param tuple|pymongo.operations _op: pymongo 的 InsertOne、UpdateOne 等 或 元组：
+            - ('insert', 数据)
+            - ('update', 条件, 修改内容) | ('updates', 条件, 修改内容) -> 修改一条 | 多条
+            - ('upsert', 条件, 修改内容) -> 不存在时添加
+            - ('replace', 条件, 数据[, upsert])
+            - ('delete', 条件) | ('deletes', 条件) -> 删除一条 | 多条
+        :return:
+        """
+        docs = None
+        if isinstance(_op, (list, tuple)):
+            _type = _op[0]
+            docs = _op[1:]
+            if _type == 'insert':
+                _op = pymongo.InsertOne(_op[1])
+            elif _type == 'update':
+                _op = pymongo.UpdateOne(_op[1], _op[2])
+            elif _type == 'updates':
+                _op = pymongo.UpdateMany(_op[1], _op[2])
+            elif _type == 'upsert':
+                _op = pymongo.UpdateOne(_op[1], _op[2], upsert = True)
+            elif _type == 'replace':
+                _op = pymongo.ReplaceOne(_op[1], _op[2], upsert = bool(_op[3]) if len(_op) > 3 else False)
+            elif _type == 'delete':
+                _op = pymongo.DeleteOne(_op[1])
+            elif _type == 'deletes':
+                _op = pymongo.DeleteMany(_op[1])
+            else:
+                raise ValueError("Unknown bulk operation '{}'".format(_type), 'mongo')
+        size = sum(len(BSON.encode(doc)) for doc in docs if isinstance(doc, dict)) if docs else 0
+        if self.__ops and self.__size + size > self.__bytes:
+            self.flush()
+        self.__ops.append(_op)
+        self.__size += size
+        if len(self.__ops) >= self.__chunk:
+            self.flush()
+        return self
+
+    def insert(self, _param):
+        """
+        添加
+        :param dict _param: 数据
+        :return:
+        """
+        return self.add(('insert', _param))
+
+    def update(self, _where, _param, _limit = True):
+        """
+        修改
+        :param dict _where: 条件
+        :param dict _param: 修改内容
+        :param bool _limit: True -> 修改一条 | False -> 修改多条
+        :return:
+        """
+        return self.add(('update' if _limit else 'updates', _where, _param))
+
+    def upsert(self, _where, _param):
+        """
+        修改，不存在时添加
+        :param dict _where: 条件
+        :param dict _param: 修改内容
+        :return:
+        """
+        return self.add(('upsert', _where, _param))
+
+    def delete(self, _where, _limit = True):
+        """
+        删除
+        :param dict _where: 条件
+        :param bool _limit: True -> 删除一条 | False -> 删除多条
+        :return:
+        """
+        return self.add(('delete' if _limit else 'deletes', _where))
+
+    def flush(self):
+        """
+        写入已累计的操作
+        :return: 本批结果
+        :rtype: dict or None
+        """
+        if not self.__ops:
+            return None
+        ops = self.__ops
+        self.__ops = []
+        self.__size = 0
+        chunk = {'chunk': self.result['chunks'] + 1, 'ops': len(ops), 'inserted': 0, 'matched': 0, 'modified': 0,
+                 'upserted': 0, 'deleted': 0, 'errors': []}
+        start = time.time()
+        try:
+            res = self.__col.bulk_write(ops, ordered = False)
+            chunk.update({'inserted': res.inserted_count, 'matched': res.matched_count,
+                          'modified': res.modified_count, 'upserted': res.upserted_count,
+                          'deleted': res.deleted_count})
+        except BulkWriteError as e:
+            # 部分失败：其他操作已写入
+            details = e.details
+            chunk.update({'inserted': details.get('nInserted', 0), 'matched': details.get('nMatched', 0),
+                          'modified': details.get('nModified', 0), 'upserted': details.get('nUpserted', 0),
+                          'deleted': details.get('nRemoved', 0)})
+            for item in details.get('writeErrors', []):
+                chunk['errors'].append({'chunk': chunk['chunk'], 'index': item.get('index'),
+                                        'code': item.get('code'), 'errmsg': item.get('errmsg')})
+            for item in details.get('writeConcernErrors', []):
+                chunk['errors'].append({'chunk': chunk['chunk'], 'index': None,
+                                        'code': item.get('code'), 'errmsg': item.get('errmsg')})
+        except Exception as e:
+            print(e)
+            chunk['errors'].append({'chunk': chunk['chunk'], 'index': None, 'code': None, 'errmsg': str(e)})
+        _stats.record('mongo', '{}.bulk'.format(self.table), time.time() - start, len(ops))
+
+        self.result['chunks'] += 1
+        for k in ('ops', 'inserted', 'matched', 'modified', 'upserted', 'deleted'):
+            self.result[k] += chunk[k]
+        self.result['errors'].extend(chunk['errors'])
+        if self.__callback:
+            self.__callback(chunk)
+        return chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+
+
+class BackgroundWriter(object):
+    def __init__(self, _client, _size = 10000, _chunk = 1000, _ms = 1000, _w = 0, _block = True):
+        """
+        后台写入：有界队列 + 后台线程，按集合累计数据，满一批 或 超过 n 毫秒时 insert_many(ordered = False)
+        - 进程退出时、index.py 每个任务结束时，自动写入队列中剩余的数据(常驻进程的子进程退出时不执行 atexit)
+        :param pymongo.MongoClient _client: 客户端，同 get_client
+        :param int _size: 队列长度
+        :param int _chunk: 每批最多数据量
+        :param int _ms: 最长累计时间(单位：毫秒)
+        :param int|str _w: 写关注，默认 0 -> 不等待确认
+        :param bool _block: 队列已满时 True -> 等待 | False -> 丢弃
+        """
+        self.__client = _client
+        self.__queue = queue.Queue(int(_size))
+        self.__chunk = max(int(_chunk), 1)
+        self.__ms = int(_ms)
+        self.__concern = WriteConcern(w = get_w(_w))
+        self.__block = _block
+        self.__closed = False
+        self.__lock = threading.Lock()
+        self.dropped = 0  # 队列已满时丢弃的数量
+        self.failed = 0  # 写入失败的数量(只在写关注不为 0 时可知)
+        self.pid = os.getpid()
+        self.__thread = threading.Thread(target = self.run, name = 'mongo-writer', daemon = True)
+        self.__thread.start()
+
+    def put(self, _table, _param):
+        """
+        放入队列：放入的是数据的副本(insert_many 会添加 _id)，之后修改 _param 不影响写入
+        - 已关闭时，直接写入
+        :param str _table: 表
+        :param dict _param: 数据
+        :return: True -> 已放入队列 或 已写入 | False -> 队列已满，丢弃
+        :rtype: bool
+        """
+        row = dict(_param)
+        with self.__lock:
+            if not self.__closed:
+                try:
+                    self.__queue.put((_table, row), self.__block)
+                except queue.Full:
+                    self.dropped += 1
+                    return False
+                return True
+        self.write(_table, [row])
+        return True
+
+    def run(self):
+        """
+        后台线程：取出队列中的数据，分集合批量写入
+        :return:
+        """
+        buffers = {}  # {表: [数据]}
+        deadline = time.time() + self.__ms / 1000
+        while True:
+            try:
+                item = self.__queue.get(timeout = max(deadline - time.time(), 0.001))
+            except queue.Empty:
+                item = None
+            if item is not None:
+                if item[0] is None:
+                    # 关闭
+                    break
+                rows = buffers.setdefault(item[0], [])
+                rows.append(item[1])
+                if len(rows) >= self.__chunk:
+                    self.write(item[0], buffers.pop(item[0]))
+            if time.time() >= deadline:
+                for table in list(buffers.keys()):
+                    self.write(table, buffers.pop(table))
+                deadline = time.time() + self.__ms / 1000
+        for table, rows in buffers.items():
+            self.write(table, rows)
+
+    def write(self, _table, _rows):
+        """
+        写入一批数据
+        :param str _table: 表
+        :param list _rows: 数据
+        :return:
+        """
+        table = _table.split('.')
+        if len(table) != 2:
+            print("Param _table's form is wrong")
+            return
+        start = time.time()
+        try:
+            conn_col = self.__client[table[0]][table[1]].with_options(write_concern = self.__concern)
+            conn_col.insert_many(_rows, ordered = False)
+        except BulkWriteError as e:
+            print(e)
+            self.failed += len(e.details.get('writeErrors', []))
+        except Exception as e:
+            print(e)
+            self.failed += len(_rows)
+        _stats.record('mongo', '{}.add_background'.format(_table), time.time() - start, len(_rows))
+
+    def close(self):
+        """
+        写入队列中剩余的数据，并结束后台线程
+        :return:
+        """
+        with self.__lock:
+            if self.__closed:
+                return
+            self.__closed = True
+            # 持有锁时放入结束标记：之后的 put 不会排在结束标记后面
+            alive = self.pid == os.getpid() and self.__thread.is_alive()
+            if alive:
+                self.__queue.put((None, None))
+        if alive:
+            self.__thread.join()
+
+
+# 后台写入：{配置分组: BackgroundWriter}
+_writers = {}
+
+
+def get_writer(_section = 'mongo'):
+    """
+    获取后台写入对象：同一进程内，相同配置分组共享一个后台线程
+    :param str _section: 配置分组
+        - int bg_size: 队列长度，默认 10000
+        - int bg_chunk: 每批最多数据量，默认 1000
+        - int bg_ms: 最长累计时间(单位：毫秒)，默认 1000
+        - str bg_w: 写关注，默认 0 -> 不等待确认
+        - int bg_block: 队列已满时 1 -> 等待(默认) | 0 -> 丢弃
+    :return:
+    :rtype: BackgroundWriter
+    """
+    with _clients_lock:
+        writer = _writers.get(_section)
+        # fork 出的子进程中没有后台线程
+        if writer is not None and writer.pid == os.getpid():
+            return writer
+    client, config = get_client(_section)
+    with _clients_lock:
+        writer = _writers.get(_section)
+        if writer is None or writer.pid != os.getpid():
+            writer = _writers[_section] = BackgroundWriter(
+                client,
+                int(config['bg_size']) if 'bg_size' in config else 10000,
+                int(config['bg_chunk']) if 'bg_chunk' in config else 1000,
+                int(config['bg_ms']) if 'bg_ms' in config else 1000,
+                config['bg_w'] if 'bg_w' in config else 0,
+                bool(int(config['bg_block'])) if 'bg_block' in config else True,
+            )
+    return writer
+
+
+def close_writers():
+    """
+    写入所有后台队列中剩余的数据
+    :return:
+    """
+    with _clients_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
+
+
+atexit.register(close_writers)
@@ -1,14 +1,29 @@
 #!/usr/bin/python
 # -*- coding:utf-8 -*-
 import pymysql
+from pymysql.constants import FIELD_TYPE
 import json
 import os
 import re
+import time
 import inspect
+import copy
+import pickle
+import hashlib
+import itertools
+import contextlib
+import collections
+import tempfile
+import threading
+import zlib
+import heapq
+import datetime
+import concurrent.futures
 
 # 自定义模块
 from mytools import tools
 from mytools import glob
+from mytools import stats
 
 
 # 自定义报错：配置错误
@@ -21,16 +36,600 @@ class EmptyError(Exception):
     pass
 
 
+class ConnectionPool(object):
+    def __init__(self, _conf):
+        """
+        初始化
+        :param dict _conf: 配置(必须内容：host, username, password, database)
+            - int pool_min: 保留的最少空闲连接数，默认 0
+            - int pool_max: 最大连接数，默认 10
+            - int pool_idle: 空闲连接超时关闭(单位：秒)，默认 600
+            - int pool_ping: 空闲超过 n 秒的连接，借出前先 ping 检测，默认 60
+            - int pool_lifetime: 连接最长使用时间(单位：秒)，默认 3600
+            - int pool_wait: 连接数已满时，等待空闲连接的时间(单位：秒)，默认 10
+        """
+        self.pid = os.getpid()
+        self.__conf = _conf
+        self.__min = int(_conf['pool_min']) if 'pool_min' in _conf else 0
+        self.__max = int(_conf['pool_max']) if 'pool_max' in _conf else 10
+        self.__idle_time = int(_conf['pool_idle']) if 'pool_idle' in _conf else 600
+        self.__ping_time = int(_conf['pool_ping']) if 'pool_ping' in _conf else 60
+        self.__lifetime = int(_conf['pool_lifetime']) if 'pool_lifetime' in _conf else 3600
+        self.__wait = int(_conf['pool_wait']) if 'pool_wait' in _conf else 10
+        self.__idle = []  # 空闲连接：[[连接, 创建时间, 最后使用时间], ...]
+        self.__born = {}  # 所有连接的创建时间：{id(连接): 创建时间}
+        self.__size = 0  # 连接数(包括：使用中、空闲、创建中)
+        self.__cond = threading.Condition()
+
+    def connect(self):
+        """
+        创建新连接
+        :return:
+        :rtype: pymysql.connections.Connection
+        """
+        conf = self.__conf
+        return pymysql.connect(host = conf['host'], user = conf['username'], passwd = conf['password'],
+                               port = int(conf['port']) if 'port' in conf else 3306, db = conf['database'],
+                               charset = conf['charset'] if 'charset' in conf else 'utf8mb4',
+                               local_infile = bool(int(conf['local_infile'])) if 'local_infile' in conf else False)
+
+    def get(self):
+        """
+        借出连接
+        :return:
+        :rtype: pymysql.connections.Connection
+        """
+        deadline = time.time() + self.__wait
+        while True:
+            conn = None
+            with self.__cond:
+                while True:
+                    now = time.time()
+                    self.reap(now)
+                    while self.__idle:
+                        conn, born, used = self.__idle.pop()
+                        if now - born <= self.__lifetime:
+                            break
+                        self.discard(conn)
+                        conn = None
+                    if conn is not None:
+                        break
+                    if self.__size < self.__max:
+                        # 先占位，防止并发创建超出最大连接数
+                        self.__size += 1
+                        break
+                    if not self.__cond.wait(deadline - now) and time.time() >= deadline:
+                        raise TimeoutError('MySql connection pool is exhausted')
+            if conn is None:
+                break
+            # 在锁外 ping：不阻塞其他借出、归还
+            if now - used > self.__ping_time:
+                try:
+                    conn.ping(reconnect = False)
+                except Exception:
+                    with self.__cond:
+                        self.discard(conn)
+                        self.__cond.notify()
+                    continue
+            return conn
+        try:
+            conn = self.connect()
+        except Exception:
+            with self.__cond:
+                self.__size -= 1
+                self.__cond.notify()
+            raise
+        with self.__cond:
+            self.__born[id(conn)] = time.time()
+        return conn
+
+    def put(self, _conn):
+        """
+        归还连接
+        :param pymysql.connections.Connection _conn:
+        :return:
+        """
+        now = time.time()
+        with self.__cond:
+            born = self.__born.get(id(_conn))
+            if born is None:
+                return
+        # 在锁外回滚未提交的事务，防止影响下一个使用者
+        try:
+            if not _conn.open or now - born > self.__lifetime:
+                raise ValueError
+            _conn.rollback()
+            reuse = True
+        except Exception:
+            reuse = False
+        with self.__cond:
+            if reuse:
+                self.__idle.append([_conn, born, now])
+            else:
+                self.discard(_conn)
+            self.__cond.notify()
+
+    def discard(self, _conn):
+        """
+        关闭连接
+        :param pymysql.connections.Connection _conn:
+        :return:
+        """
+        if self.__born.pop(id(_conn), None) is not None:
+            self.__size -= 1
+        try:
+            _conn.close()
+        except Exception:
+            pass
+
+    def reap(self, _now):
+        """
+        关闭超时的空闲连接
+        :param float _now: 当前时间戳
+        :return:
+        """
+        while len(self.__idle) > self.__min and _now - self.__idle[0][2] > self.__idle_time:
+            self.discard(self.__idle.pop(0)[0])
+
+    def close(self):
+        """
+        关闭所有空闲连接
+        :return:
+        """
+        with self.__cond:
+            while self.__idle:
+                self.discard(self.__idle.pop()[0])
+
+
+# 连接池：{(host, port, username, database, charset, local_infile): ConnectionPool}
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(_conf):
+    """
+    获取连接池：同一进程内，相同配置共享一个连接池
+    :param dict _conf: 配置
+    :return:
+    :rtype: ConnectionPool
+    """
+    key = (_conf['host'], int(_conf['port']) if 'port' in _conf else 3306, _conf['username'], _conf['database'],
+           _conf['charset'] if 'charset' in _conf else 'utf8mb4',
+           bool(int(_conf['local_infile'])) if 'local_infile' in _conf else False)
+    with _pools_lock:
+        pool = _pools.get(key)
+        # fork 出的子进程不能复用父进程的连接
+        if pool is None or pool.pid != os.getpid():
+            pool = _pools[key] = ConnectionPool(_conf)
+    return pool
+
+
+def close_pools():
+    """
+    关闭所有连接池的空闲连接
+    :return:
+    """
+    with _pools_lock:
+        for pool in _pools.values():
+            if pool.pid == os.getpid():
+                pool.close()
+        _pools.clear()
+
+
+class ReplicaSet(object):
+    def __init__(self, _conf):
+        """
+        初始化：从库与主库使用相同的账号、数据库，每个从库一个连接池
+        :param dict _conf: 主库配置
+            - str replicas: 从库地址，多个以逗号分隔：host[:port],host[:port]
+            - str replica_policy: 选择从库的方式 round_robin -> 轮询(默认) | latency -> 延迟最低
+            - int replica_retry: 从库不可用时，n 秒内不再使用(单位：秒)，默认 30
+        """
+        self.__conf = _conf
+        self.__policy = _conf['replica_policy'] if 'replica_policy' in _conf else 'round_robin'
+        if self.__policy not in ('round_robin', 'latency'):
+            raise ConfigError('replica_policy must be round_robin or latency', 'mysql')
+        self.__retry = int(_conf['replica_retry']) if 'replica_retry' in _conf else 30
+        self.hosts = []
+        for item in _conf['replicas'].split(','):
+            item = item.strip()
+            if not item:
+                continue
+            host, _, port = item.partition(':')
+            self.hosts.append((host, int(port) if port else int(_conf['port']) if 'port' in _conf else 3306))
+        self.__next = 0  # 轮询位置
+        self.__down = {}  # 不可用的从库：{序号: 恢复时间戳}
+        self.__latency = {}  # 从库延迟(指数移动平均)：{序号: 秒}
+        self.__lock = threading.Lock()
+
+    def choose(self, _exclude = None):
+        """
+        选择从库
+        :param set|None _exclude: 本次已尝试失败的从库序号
+        :return: None -> 没有可用从库 | 从库序号
+        :rtype: int or None
+        """
+        now = time.time()
+        with self.__lock:
+            alive = [i for i in range(len(self.hosts))
+                     if self.__down.get(i, 0) <= now and not (_exclude and i in _exclude)]
+            if not alive:
+                return None
+            if self.__policy == 'latency':
+                # 未测量过的从库优先
+                return min(alive, key = lambda i: self.__latency.get(i, 0))
+            for _ in range(len(self.hosts)):
+                i = self.__next % len(self.hosts)
+                self.__next += 1
+                if i in alive:
+                    return i
+        return None
+
+    def get_pool(self, _index):
+        """
+        获取从库连接池
+        :param int _index: 从库序号
+        :return:
+        :rtype: ConnectionPool
+        """
+        conf = dict(self.__conf)
+        conf['host'], conf['port'] = self.hosts[_index]
+        return get_pool(conf)
+
+    def record(self, _index, _seconds):
+        """
+        记录从库延迟
+        :param int _index: 从库序号
+        :param float _seconds: 耗时
+        :return:
+        """
+        with self.__lock:
+            last = self.__latency.get(_index)
+            self.__latency[_index] = _seconds if last is None else last * 0.8 + _seconds * 0.2
+
+    def mark_down(self, _index):
+        """
+        标记从库不可用
+        :param int _index: 从库序号
+        :return:
+        """
+        with self.__lock:
+            self.__down[_index] = time.time() + self.__retry
+            self.__latency.pop(_index, None)
+
+
+# 从库：{(主库 host, port, username, database, 从库地址): ReplicaSet}
+_replicas = {}
+
+
+def get_replicas(_conf):
+    """
+    获取从库：同一进程内，相同配置共享一个 ReplicaSet
+    :param dict _conf: 主库配置
+    :return: None -> 未配置从库
+    :rtype: ReplicaSet or None
+    """
+    if not _conf.get('replicas'):
+        return None
+    key = (_conf['host'], int(_conf['port']) if 'port' in _conf else 3306, _conf['username'], _conf['database'],
+           _conf['replicas'])
+    with _pools_lock:
+        replicas = _replicas.get(key)
+        if replicas is None:
+            replicas = _replicas[key] = ReplicaSet(_conf)
+    return replicas
+
+
+# 已拼接的 SQL：{(操作, 表, 字段): SQL}
+_sql_cache = {}
+_SQL_CACHE_SIZE = 1024
+
+
+def get_cache_sql(_key):
+    """
+    获取已拼接的 SQL
+    :param tuple _key: (操作, 表, 字段)
+    :return:
+    :rtype: str or None
+    """
+    return _sql_cache.get(_key)
+
+
+def set_cache_sql(_key, _sql):
+    """
+    记录已拼接的 SQL
+    :param tuple _key: (操作, 表, 字段)
+    :param str _sql:
+    :return:
+    :rtype: str
+    """
+    if len(_sql_cache) >= _SQL_CACHE_SIZE:
+        _sql_cache.clear()
+    _sql_cache[_key] = _sql
+    return _sql
+
+
+def raw(_sql):
+    """
+    SQL 固定内容(表名、字段、排序等)：转义 % ，防止与占位符 %s 冲突
+    :param str _sql:
+    :return:
+    :rtype: str
+    """
+    return str(_sql).replace('%', '%%')
+
+
+# 查询结果格式
+ROW_FORMATS = ('dict', 'tuple', 'namedtuple', 'column', 'array', 'numpy')
+
+# 按列返回的查询结果格式
+COLUMN_FORMATS = ('column', 'array', 'numpy')
+
+# 数值字段类型：{字段类型: int | float}
+_field_types = {
+    FIELD_TYPE.TINY: int, FIELD_TYPE.SHORT: int, FIELD_TYPE.LONG: int, FIELD_TYPE.INT24: int,
+    FIELD_TYPE.LONGLONG: int, FIELD_TYPE.YEAR: int,
+    FIELD_TYPE.FLOAT: float, FIELD_TYPE.DOUBLE: float, FIELD_TYPE.DECIMAL: float, FIELD_TYPE.NEWDECIMAL: float,
+}
+
+# namedtuple 类：{(字段, ...): namedtuple}
+_row_types = {}
+
+
+def get_types(_description):
+    """
+    获取 数值字段的类型
+    :param tuple _description: cursor.description
+    :return: {字段: int | float}
+    :rtype: dict
+    """
+    result = {}
+    for field in _description:
+        if field[1] in _field_types:
+            result[field[0]] = _field_types[field[1]]
+
+    return result
+
+
+def get_rows(_data, _columns, _format = 'dict', _types = None):
+    """
+    转换 查询结果格式
+    :param list|tuple _data: 查询结果(每行为 tuple)
+    :param list _columns: 字段名
+    :param str _format: 格式，同 MySql.row_format()
+    :param dict|None _types: array, numpy 格式时，数值字段的类型 {字段: int | float}
+    :return:
+    :rtype: list or dict
+    """
+    if _format == 'tuple':
+        return list(_data)
+    elif _format == 'namedtuple':
+        key = tuple(_columns)
+        row_type = _row_types.get(key)
+        if row_type is None:
+            row_type = _row_types[key] = collections.namedtuple('Row', _columns, rename = True)
+        return [row_type._make(item) for item in _data]
+    elif _format in COLUMN_FORMATS:
+        if not _data:
+            result = dict((col, []) for col in _columns)
+        else:
+            result = dict((col, list(values)) for col, values in zip(_columns, zip(*_data)))
+        return result if _format == 'column' else tools.array_columns(result, _types, _format)
+
+    return [dict(zip(_columns, item)) for item in _data]
+
+
+def get_column(_column):
+    """
+    获取 字段名(加反引号)
+    :param str _column: 字段名：id | A.id
+    :return:
+    :rtype: str
+    """
+    columns = raw(_column).split('.')
+    columns[-1] = '`' + columns[-1].strip('`') + '`'
+    return '.'.join(columns)
+
+
+def get_value(_value):
+    """
+    获取 添加/修改 的值
+    :param _value:
+    :return: None, '' -> NULL | list, tuple, dict -> json 字符串 | bool -> 1/0 | 其他 -> 字符串
+    :rtype: str or None
+    """
+    if _value is None or _value == '':
+        return None
+    elif tools.is_array(_value):
+        return json.dumps(_value)
+    elif isinstance(_value, bool):
+        return '1' if _value else '0'
+    return str(_value)
+
+
+def get_tsv_value(_value):
+    """
+    获取 LOAD DATA 文件中的值(默认格式：制表符分隔字段，换行符分隔行，反斜杠转义)
+    :param _value:
+    :return: None, '' -> NULL | list, tuple, dict -> json 字符串 | 其他 -> 字符串
+    :rtype: str
+    """
+    if _value is None or _value == '':
+        return '\\N'
+    elif tools.is_array(_value):
+        _value = json.dumps(_value)
+    elif isinstance(_value, bool):
+        _value = int(_value)
+    return str(_value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace(
+        '\r', '\\r').replace('\0', '\\0')
+
+
+class QueryCache(object):
+    def __init__(self, _size = 1024, _path = None):
+        """
+        初始化：查询结果缓存(LRU)
+        :param int _size: 最多缓存的查询数量
+        :param str|None _path: 磁盘缓存目录(同一台机器上的多个任务进程共享)；默认：只缓存在内存
+        """
+        self.__size = int(_size)
+        self.__path = _path.rstrip('/') + '/' if _path else None
+        self.__data = collections.OrderedDict()  # {键: (过期时间, 表, 结果)}
+        self.__lock = threading.Lock()
+
+    def get(self, _key):
+        """
+        获取缓存
+        :param str _key: 键
+        :return: None -> 无缓存 | 查询结果
+        """
+        now = time.time()
+        with self.__lock:
+            item = self.__data.get(_key)
+            if item is not None:
+                if item[0] > now:
+                    self.__data.move_to_end(_key)
+                    return copy.deepcopy(item[2])
+                del self.__data[_key]
+        if not self.__path:
+            return None
+        # 磁盘缓存：表被修改过(版本号不同)则失效
+        try:
+            with open(self.__path + _key + '.cache', 'rb') as fpr:
+                expire, versions, result = pickle.load(fpr)
+        except (OSError, EOFError, pickle.PickleError, ValueError):
+            return None
+        if expire <= now:
+            return None
+        for table, version in versions.items():
+            if self.get_version(table) != version:
+                return None
+        with self.__lock:
+            self.__put(_key, expire, list(versions.keys()), result)
+        return copy.deepcopy(result)
+
+    def set(self, _key, _tables, _result, _ttl = 60):
+        """
+        设置缓存
+        :param str _key: 键
+        :param list _tables: 查询涉及的表
+        :param _result: 查询结果
+        :param int _ttl: 缓存时间(单位：秒)
+        :return:
+        """
+        expire = time.time() + _ttl
+        _result = copy.deepcopy(_result)
+        with self.__lock:
+            self.__put(_key, expire, _tables, _result)
+        if self.__path:
+            tools.mk_dir(self.__path + _key)
+            path = self.__path + _key + '.cache'
+            with open(path + '.' + str(os.getpid()), 'wb') as fpw:
+                pickle.dump((expire, dict((table, self.get_version(table)) for table in _tables), _result), fpw)
+            os.replace(path + '.' + str(os.getpid()), path)
+
+    def __put(self, _key, _expire, _tables, _result):
+        self.__data[_key] = (_expire, _tables, _result)
+        self.__data.move_to_end(_key)
+        while len(self.__data) > self.__size:
+            self.__data.popitem(last = False)
+
+    def invalidate(self, _tables):
+        """
+        表被修改：删除相关缓存
+        :param list _tables: 表
+        :return:
+        """
+        _tables = set(_tables)
+        with self.__lock:
+            for key in [k for k, v in self.__data.items() if _tables.intersection(v[1])]:
+                del self.__data[key]
+        if self.__path:
+            for table in _tables:
+                path = self.__path + 'tables/' + table
+                tools.mk_dir(path)
+                with open(path, 'w', encoding = 'utf-8') as fpw:
+                    fpw.write(repr(time.time()) + '.' + str(os.getpid()))
+
+    def get_version(self, _table):
+        """
+        获取 表的版本号(磁盘缓存)
+        :param str _table: 表
+        :return:
+        :rtype: str
+        """
+        try:
+            with open(self.__path + 'tables/' + _table, 'r', encoding = 'utf-8') as fpr:
+                return fpr.read()
+        except OSError:
+            return ''
+
+    def clear(self):
+        """
+        清空内存缓存
+        :return:
+        """
+        with self.__lock:
+            self.__data.clear()
+
+
+# 查询结果缓存
+_query_cache = None
+
+
+def get_cache(_conf = None):
+    """
+    获取查询结果缓存：同一进程内共享
+    :param dict|None _conf: 配置
+        - int cache_size: 最多缓存的查询数量，默认 1024
+        - str cache_dir: 磁盘缓存目录；默认：只缓存在内存
+    :return:
+    :rtype: QueryCache
+    """
+    global _query_cache
+    if _query_cache is None:
+        _conf = _conf if _conf else {}
+        _query_cache = QueryCache(_conf['cache_size'] if 'cache_size' in _conf else 1024,
+                                  _conf['cache_dir'] if 'cache_dir' in _conf else None)
+    return _query_cache
+
+
+def is_connection_error(_error):
+    """
+    是否为连接错误：2000+ 为客户端连接错误(连接失败、连接断开等)，SQL 本身的错误不是
+    :param Exception _error:
+    :return:
+    :rtype: bool
+    """
+    return isinstance(_error, pymysql.err.OperationalError) and bool(_error.args) and isinstance(
+        _error.args[0], int) and _error.args[0] >= 2000
+
+
+def get_tables(_table):
+    """
+    获取 SQL 表名中涉及的所有表(用于缓存失效)
+    :param str _table: 表名，如：user | db.user AS u LEFT JOIN log ON ...
+    :return: 表名 及 去掉库名的表名
+    :rtype: list
+    """
+    tables = set()
+    for table in re.findall(r'[\w$.]+', str(_table).replace('`', '').lower()):
+        tables.add(table)
+        tables.add(table.split('.')[-1])
+    return list(tables)
+
+
 class MySql(object):
-    def __init__(self, conf = None):
+    def __init__(self, conf = None, _section = 'mysql', _connect = True):
         # Core.__init__(self)
         """
         初始化
         :param dict conf: 配置(必须内容：host, username, password, database)
+        :param str _section: conf 为空时，读取的配置分组
+        :param bool _connect: 是否连接数据库；False -> 只拼接 SQL (配合 get_query 使用)
         """
         if not conf:
             # 获取 mysql 配置
-            conf = tools.configs(_section = 'mysql')
+            conf = tools.configs(_section = _section)
         if ('host' not in conf) or ('username' not in conf) or ('password' not in conf) or ('database' not in conf):
             raise ConfigError('Miss host,username,password or database', 'mysql')
         self.__host = conf['host']
@@ -39,6 +638,7 @@ class MySql(object):
         self.__database = conf['database']
         self.__port = int(conf['port']) if 'port' in conf else 3306
         self.__charset = conf['charset'] if 'charset' in conf else 'utf8mb4'
+        self.__local_infile = bool(int(conf['local_infile'])) if 'local_infile' in conf else False
         self.__conn = None
         self.__cur = None
         self.__sql = None
@@ -48,11 +648,29 @@ class MySql(object):
         self.__param = []
         self.__limit = ''
         self.__check = False
+        self.__format = 'dict'
+        self.__columns = []
+        self.__table = None  # 本次操作的表
+        self.__cache_ttl = 0  # 查询结果缓存时间
+        self.__cache = get_cache(conf)
+        self.__cache_key = '{}:{}/{}'.format(self.__host, self.__port, self.__database)
+        self.__transaction = False  # 是否在事务中
+        self.__batch = None  # 批量提交：(条数, 毫秒)
+        self.__pending = 0  # 未提交的语句数量
+        self.__pending_time = 0  # 第一条未提交语句的时间
+        self.__touched = set()  # 未提交的语句修改的表：提交后删除相关缓存
+        self.__replicas = get_replicas(conf)  # 从库
+        self.__primary = False  # 下一次查询是否强制使用主库
         self.__error = {}
 
+        self.__pool = get_pool(conf)
+        if not _connect:
+            self.set_default()
+            return
+
         try:
-            self.__conn = pymysql.connect(host = self.__host, user = self.__username, passwd = self.__password,
-                                          port = self.__port, db = self.__database, charset = self.__charset)
+            # 从连接池借出连接
+            self.__conn = self.__pool.get()
             self.__cur = self.__conn.cursor()
             self.set_default()
         except Exception as e:
@@ -68,6 +686,10 @@ class MySql(object):
         self.__param = []
         self.__limit = ''
         self.__check = False
+        self.__format = 'dict'
+        self.__table = None
+        self.__cache_ttl = 0
+        self.__primary = False
 
     def select(self, _table, _where = None, _key = None, _order = None, _pos = 0):
         """
@@ -89,8 +711,9 @@ class MySql(object):
         # 排序
         self.get_order(_order)
 
-        self.__sql = 'SELECT ' + _key + ' FROM ' + str(_table) + self.__where + self.__order + ' LIMIT ' + str(
-            _pos) + ',1'
+        self.__sql = 'SELECT ' + raw(_key) + ' FROM ' + raw(_table) + self.__where + self.__order + ' LIMIT ' + str(
+            int(_pos)) + ',1'
+        self.__table = _table
         res = self.query_sql('s')
 
         return res
@@ -116,12 +739,115 @@ class MySql(object):
         # 分组
         self.get_group(_group)
         # 查询数据量
-        self.__sql = 'SELECT ' + _key + ' FROM ' + str(
+        self.__sql = 'SELECT ' + raw(_key) + ' FROM ' + raw(
             _table) + self.__where + self.__group + self.__order + self.__limit
+        self.__table = _table
         res = self.query_sql('se')
 
         return res
 
+    def iselects(self, _table, _order = None, _key = None, _where = None, _group = None, _batch = None):
+        """
+        流式查询多条数据：使用服务端游标(SSCursor)逐批读取，内存占用与数据量无关
+        - 遍历结束前，当前连接不能执行其他 SQL
+        :param str _table: 表
+        :param str|None _order: 排序
+        :param str|None _key: 查询字段
+        :param str| dict _where: 查询条件
+        :param str _group: 分组
+        :param int|None _batch: 每批数据量 None -> 逐条返回 dict | int -> 每次返回 list[dict]
+        :return: SQL 语句(get_sql 时) | 生成器
+        :rtype: str or generator
+        """
+        # 获取查询条件
+        self.get_where(_where)
+        # 字段名
+        if not _key:
+            _key = '*'
+        # 排序
+        self.get_order(_order)
+        # 分组
+        self.get_group(_group)
+        self.__sql = 'SELECT ' + raw(_key) + ' FROM ' + raw(
+            _table) + self.__where + self.__group + self.__order + self.__limit
+        if self.__check:
+            return self.query_sql('se')
+
+        sql = self.__sql
+        param = tuple(self.__param)
+        _format = self.__format
+        replica = not self.__primary
+        # 恢复默认值
+        self.set_default()
+
+        return self.stream_sql(sql, param, _batch, _format, replica)
+
+    def stream_sql(self, _sql, _param = None, _batch = None, _format = 'dict', _replica = False):
+        """
+        流式执行 SQL
+        :param str _sql: SQL 语句
+        :param list|tuple|None _param: _sql 中占位符 %s 对应的值
+        :param int|None _batch: 每批数据量 None -> 逐条返回 | int -> 每次返回一批
+        :param str _format: 查询结果格式，同 row_format()
+        :param bool _replica: 是否优先使用从库(只读 SQL)
+        :return: 生成器
+        :rtype: generator
+        """
+        if _format in COLUMN_FORMATS and not _batch:
+            raise ValueError('Param \'_batch\' can not be empty when _format is ' + _format, 'mysql')
+        replica = None
+        if _replica and self.__replicas and not (self.__transaction or self.__pending):
+            replica = self.__get_replica()
+        cur = (replica[1] if replica else self.__conn).cursor(pymysql.cursors.SSCursor)
+        total = 0
+        start = time.time()
+        try:
+            if replica:
+                try:
+                    cur.execute(_sql, _param)
+                    self.__replicas.record(replica[0], time.time() - start)
+                except pymysql.err.OperationalError as e:
+                    if not is_connection_error(e):
+                        raise
+                    # 从库不可用：回退到主库
+                    cur.close()
+                    self.__put_replica(replica, e)
+                    replica = None
+                    cur = self.__conn.cursor(pymysql.cursors.SSCursor)
+                    cur.execute(_sql, _param)
+            else:
+                cur.execute(_sql, _param)
+            cols_list = [field[0] for field in cur.description]
+            types = get_types(cur.description)
+            while True:
+                data = cur.fetchmany(_batch if _batch else 1000)
+                if not data:
+                    break
+                total += len(data)
+                rows = get_rows(data, cols_list, _format, types)
+                if _batch:
+                    yield rows
+                else:
+                    for row in rows:
+                        yield row
+        except Exception as e:
+            tools.logs('/mysql/error',
+                       {'file_type': 'mysql', 'message': e, 'sql': self.get_statement(_sql, _param)},
+                       'error',
+                       _type = 3)
+            # 读取过程中从库断开：已返回部分数据，不能回退，标记从库不可用
+            if replica and is_connection_error(e):
+                cur.close()
+                self.__put_replica(replica, e)
+                replica = None
+            raise
+        finally:
+            cur.close()
+            if replica:
+                self.__put_replica(replica)
+            # 耗时统计(包括调用方处理数据的时间)
+            stats.record('mysql', stats.get_shape(_sql), time.time() - start, total, len(_sql), [_sql, _param])
+
     def update(self, _table, _where = None, _param = None, _limit = True):
         """
         修改
@@ -132,30 +858,34 @@ class MySql(object):
         :return: False | 修改数量
         :rtype: bool
         """
-        # 获取查询条件
-        self.get_where(_where, True)
+        if not _where:
+            raise EmptyError('Miss _where', 'mysql')
         if not _param:
             raise ValueError('Param \'_param\' can not be empty', 'mysql')
         if not isinstance(_param, dict):
             raise TypeError(_param, 'mysql')
 
-        # 获取修改内容
-        lst = []
-        for k, v in _param.items():
-            if isinstance(k, int):
-                lst.append(v)
-            else:
-                if not v:
-                    lst.append('`' + k + '`=NULL')
-                elif tools.is_array(v):
-                    lst.append('`' + k + '`=\'' + json.dumps(v) + '\'')
+        # 获取修改内容：相同 表+字段 的 SQL 只拼接一次
+        key = ('update', _table, tuple((k, v) if isinstance(k, int) else k for k, v in _param.items()))
+        sql = get_cache_sql(key)
+        if sql is None:
+            lst = []
+            for k, v in _param.items():
+                if isinstance(k, int):
+                    lst.append(raw(v))
                 else:
-                    lst.append('`' + k + '`=\'' + str(v) + '\'')
-        _param = ','.join(lst)
+                    lst.append('`' + raw(k) + '`=%s')
+            sql = set_cache_sql(key, 'UPDATE ' + raw(_table) + ' SET ' + ','.join(lst))
+        for k, v in _param.items():
+            if not isinstance(k, int):
+                self.__param.append(get_value(v))
 
+        # 获取查询条件
+        self.get_where(_where, True)
         _limit = ' LIMIT 1' if _limit else ''
 
-        self.__sql = 'UPDATE ' + _table + ' SET ' + _param + self.__where + _limit
+        self.__sql = sql + self.__where + _limit
+        self.__table = _table
         res = self.query_sql('u')
 
         return res
@@ -172,19 +902,19 @@ class MySql(object):
             return False
         if not isinstance(_param, dict):
             raise TypeError(_param, 'mysql')
-        # 获取添加内容
-        keys = []
-        values = []
-        for k, v in _param.items():
-            keys.append('`' + k + '`')
-            if v is None or v == '':
-                values.append('NULL')
-            elif tools.is_array(v):
-                values.append('\'' + re.escape(json.dumps(v)) + '\'')
-            else:
-                values.append('\'' + str(v) + '\'')
+        # 获取添加内容：相同 表+字段 的 SQL 只拼接一次
+        key = ('add', _table, tuple(_param.keys()))
+        sql = get_cache_sql(key)
+        if sql is None:
+            keys = []
+            for k in _param.keys():
+                keys.append('`' + raw(k) + '`')
+            sql = set_cache_sql(key, 'INSERT INTO ' + raw(_table) + ' ( ' + (','.join(keys)) + ') VALUES (' + (
+                ','.join(['%s'] * len(keys))) + ')')
 
-        self.__sql = 'INSERT INTO ' + _table + ' ( ' + (','.join(keys)) + ') VALUES (' + (','.join(values)) + ')'
+        self.__sql = sql
+        self.__param = [get_value(v) for v in _param.values()]
+        self.__table = _table
         result_bool = self.query_sql('a')
 
         return result_bool
@@ -193,39 +923,210 @@ class MySql(object):
         """
         添加多条数据
         :param str _table: 表
-        :param dict _params: 添加内容
-        :return: False | 新增id
-        :rtype: bool or list
+        :param list _params: 添加内容
+        :return: False | 新增id(第一条数据的id)
+        :rtype: bool or int
         """
         if not _params:
             return False
-        # 获取添加内容
-        keys = []
-        for k, v in _params[0].items():
-            keys.append('`' + k + '`')
+        result = self.bulk_add(_table, _params)
+        if self.__check or not result:
+            return result
 
-        values = []
-        value = []
+        return result['first_id'] if result['rows'] else False
+
+    def bulk_add(self, _table, _params = None, _mode = None, _update = None, _chunk = 1000, _bytes = 1048576,
+                 _callback = None):
+        """
+        批量添加：分批 executemany，内存占用与数据总量无关
+        - 未指定 _callback 时：所有批次在同一事务中提交，任一批失败时全部回滚
+        - 指定 _callback 时：每批单独提交，某批失败时返回 False，之前的批次已提交(通过 _callback 得知已提交的行数)
+        :param str _table: 表
+        :param list|iterable _params: 添加内容(dict 的可迭代对象，字段以第一条数据为准，缺少的字段为 NULL)
+        :param str|None _mode: 添加方式
+            - None -> INSERT
+            - ignore -> INSERT IGNORE
+            - replace -> REPLACE
+            - update -> INSERT ... ON DUPLICATE KEY UPDATE
+        :param list|None _update: _mode = update 时要更新的字段；默认：全部字段
+        :param int _chunk: 每批最多行数
+        :param int _bytes: 每批最多字节数(估算值，需小于 max_allowed_packet)
+        :param function _callback: 每批提交后回调：_callback({'chunk': 批次, 'rows': 累计行数, 'affected': 累计影响行数})
+        :return: False | {'rows': 总行数, 'affected': 影响行数, 'chunks': 批次数, 'first_id': 第一条数据的id}
+        :rtype: bool or dict
+        """
+        if not _params:
+            return False
+        if _mode not in (None, 'ignore', 'replace', 'update'):
+            raise ValueError('Param \'_mode\' must be ignore, replace or update', 'mysql')
+        params = iter(_params)
+        # 获取添加内容：字段以第一条数据为准
+        first = None
+        for first in params:
+            if isinstance(first, dict):
+                break
+            tools.logs('/mysql/error', {'file_type': 'mysql', 'message': first}, 'error', _type = 3)
+            first = None
+        if not first:
+            self.set_default()
+            return False
+        keys = list(first.keys())
+
+        sql = ('REPLACE' if _mode == 'replace' else 'INSERT IGNORE' if _mode == 'ignore' else 'INSERT') + \
+            ' INTO ' + raw(_table) + ' (' + (','.join(['`' + raw(k) + '`' for k in keys])) + ') VALUES (' + (
+                ','.join(['%s'] * len(keys))) + ')'
+        if _mode == 'update':
+            _update = _update if _update else keys
+            sql += ' ON DUPLICATE KEY UPDATE ' + (','.join(['`{0}`=VALUES(`{0}`)'.format(raw(k)) for k in _update]))
+
+        if self.__check:
+            result = self.__cur.mogrify(sql, [get_value(first.get(k)) for k in keys])
+            self.set_default()
+            return result
+
+        if _callback or self.__transaction:
+            return self.__add_chunks(_table, sql, keys, itertools.chain([first], params), _chunk, _bytes, _callback)
+        try:
+            with self.transaction():
+                return self.__add_chunks(_table, sql, keys, itertools.chain([first], params), _chunk, _bytes)
+        except pymysql.err.Error:
+            # 已由 __add_chunk 记录日志，transaction() 已回滚
+            return False
+
+    def __add_chunks(self, _table, _sql, _keys, _params, _chunk, _bytes, _callback = None):
+        """
+        分批添加，参数同 bulk_add
+        :param str _sql: SQL 语句
+        :param list _keys: 字段
+        :return: False | 结果，同 bulk_add
+        :rtype: bool or dict
+        """
+        result = {'rows': 0, 'affected': 0, 'chunks': 0, 'first_id': None}
+        rows = []
+        size = 0
         for _param in _params:
             if not isinstance(_param, dict):
+                tools.logs('/mysql/error', {'file_type': 'mysql', 'message': _param}, 'error', _type = 3)
+                continue
+            row = [get_value(_param.get(k)) for k in _keys]
+            # 估算本行字节数
+            row_size = 0
+            for v in row:
+                row_size += len(v) + 3 if v is not None else 5
+            if rows and (len(rows) >= _chunk or size + row_size > _bytes):
+                if not self.__add_chunk(_table, _sql, rows, result, _callback):
+                    return False
+                rows = []
+                size = 0
+            rows.append(row)
+            size += row_size
+        if rows and not self.__add_chunk(_table, _sql, rows, result, _callback):
+            return False
+
+        self.set_default()
+        return result
+
+    def __add_chunk(self, _table, _sql, _rows, _result, _callback = None):
+        """
+        提交一批数据
+        :param str _table: 表
+        :param str _sql: SQL 语句
+        :param list _rows: 本批数据
+        :param dict _result: 累计结果
+        :param function _callback: 回调
+        :return:
+        :rtype: bool
+        """
+        start = time.time()
+        try:
+            affected = self.__cur.executemany(_sql, _rows)
+            self.__touched.update(get_tables(_table))
+            self.commit()
+        except Exception as e:
+            tools.logs('/mysql/error',
+                       {'file_type': 'mysql', 'message': e, 'sql': _sql, 'chunk': _result['chunks'] + 1,
+                        'committed': 0 if self.__transaction else _result['rows']},
+                       'error',
+                       _type = 3)
+            self.set_default()
+            if self.__transaction:
+                raise
+            self.rollback()
+            return False
+
+        stats.record('mysql', stats.get_shape(_sql), time.time() - start, affected, len(_sql), [_sql, len(_rows)])
+        if _result['first_id'] is None:
+            _result['first_id'] = self.__cur.lastrowid
+        _result['rows'] += len(_rows)
+        _result['affected'] += affected if affected else 0
+        _result['chunks'] += 1
+        if _callback:
+            _callback({'chunk': _result['chunks'], 'rows': _result['rows'], 'affected': _result['affected']})
+        return True
+
+    def load_rows(self, _table, _rows = None, _columns = None, _mode = None):
+        """
+        批量导入：写入临时 TSV 文件后执行 LOAD DATA LOCAL INFILE (需配置 local_infile = 1)
+        :param str _table: 表
+        :param list|iterable _rows: 导入内容(dict 或 list/tuple 的可迭代对象)
+        :param list|None _columns: 字段；默认：第一条 dict 数据的键(list/tuple 数据必须指定)
+        :param str|None _mode: 重复数据处理方式 None -> 报错 | ignore -> 跳过 | replace -> 替换
+        :return: False | {'rows': 影响行数, 'warnings': 警告数量}
+        :rtype: bool or dict
+        """
+        if not self.__local_infile:
+            raise ConfigError('Miss local_infile = 1', 'mysql')
+        if _mode not in (None, 'ignore', 'replace'):
+            raise ValueError('Param \'_mode\' must be ignore or replace', 'mysql')
+        if not _rows:
+            return False
+
+        # 写入临时文件
+        fpw = tempfile.NamedTemporaryFile('w', encoding = 'utf-8', suffix = '.tsv', newline = '\n', delete = False)
+        try:
+            with fpw:
+                for row in _rows:
+                    if isinstance(row, dict):
+                        if not _columns:
+                            _columns = list(row.keys())
+                        row = [row.get(k) for k in _columns]
+                    elif not isinstance(row, (list, tuple)):
+                        tools.logs('/mysql/error', {'file_type': 'mysql', 'message': row}, 'error', _type = 3)
+                        continue
+                    fpw.write('\t'.join([get_tsv_value(v) for v in row]) + '\n')
+            if not _columns:
+                raise ValueError('Param \'_columns\' can not be empty', 'mysql')
+
+            self.__sql = 'LOAD DATA LOCAL INFILE %s ' + (_mode.upper() + ' ' if _mode else '') + 'INTO TABLE ' + raw(
+                _table) + ' CHARACTER SET utf8mb4 (' + (','.join(['`' + raw(k) + '`' for k in _columns])) + ')'
+            self.__param = [fpw.name]
+            if self.__check:
+                return self.query_sql()
+
+            start = time.time()
+            try:
+                rows = self.__cur.execute(self.__sql, tuple(self.__param))
+                stats.record('mysql', stats.get_shape(self.__sql), time.time() - start, rows, len(self.__sql),
+                             self.__sql)
+                # 提交前读取警告数量(COMMIT 会清空警告)
+                self.__cur.execute('SHOW COUNT(*) WARNINGS')
+                result = {'rows': rows, 'warnings': self.__cur.fetchone()[0]}
+                self.__touched.update(get_tables(_table))
+                self.commit()
+            except Exception as e:
                 tools.logs('/mysql/error',
-                           {'file_type': 'mysql', 'message': _param},
+                           {'file_type': 'mysql', 'message': e, 'sql': self.__sql},
                            'error',
                            _type = 3)
-                continue
-            for k, v in _param.items():
-                if v is None or v == '':
-                    value.append('NULL')
-                elif tools.is_array(v):
-                    value.append('\'' + re.escape(json.dumps(v)) + '\'')
-                else:
-                    value.append('\'' + str(v) + '\'')
-            values.append('(' + (','.join(value)) + ')')
-
-        self.__sql = 'INSERT INTO ' + _table + ' ( ' + (','.join(keys)) + ') VALUES ' + (','.join(values))
-        res = self.query_sql('a')
+                if self.__transaction:
+                    self.set_default()
+                    raise
+                result = False
+        finally:
+            os.remove(fpw.name)
 
-        return res
+        self.set_default()
+        return result
 
     def delete(self, _table, _where = None, _limit = True):
         """
@@ -240,7 +1141,8 @@ class MySql(object):
         self.get_where(_where, True)
         _limit = ' LIMIT 1' if _limit else ''
 
-        self.__sql = 'DELETE FROM ' + str(_table) + ' WHERE ' + self.__where + _limit
+        self.__sql = 'DELETE FROM ' + raw(_table) + self.__where + _limit
+        self.__table = _table
         res = self.query_sql('d')
 
         return res
@@ -255,8 +1157,13 @@ class MySql(object):
         """
         # 获取查询条件
         self.get_where(_where)
-        self.__sql = 'SELECT COUNT(*) total FROM ' + str(_table) + self.__where
+        self.__sql = 'SELECT COUNT(*) total FROM ' + raw(_table) + self.__where
+        self.__format = 'dict'
+        self.__table = _table
         result = self.query_sql('s')
+        if isinstance(result, (str, tuple)):
+            # get_sql、get_query
+            return result
         res = result['total'] if result else 0
 
         return res
@@ -274,8 +1181,13 @@ class MySql(object):
             return False
         # 获取查询条件
         self.get_where(_where)
-        self.__sql = 'SELECT SUM(' + str(_key) + ') total FROM ' + str(_table) + self.__where
+        self.__sql = 'SELECT SUM(' + raw(_key) + ') total FROM ' + raw(_table) + self.__where
+        self.__format = 'dict'
+        self.__table = _table
         result = self.query_sql('s')
+        if isinstance(result, (str, tuple)):
+            # get_sql、get_query
+            return result
         res = result['total'] if result else 0
 
         return res
@@ -288,7 +1200,130 @@ class MySql(object):
         :return:
         """
         if _count:
-            self.__limit = ' LIMIT ' + str(_count * (_page - 1)) + ',' + str(_count)
+            self.__limit = ' LIMIT ' + str(int(_count) * (int(_page) - 1)) + ',' + str(int(_count))
+        return self
+
+    def keyset(self, _table, _key = 'id', _count = 1000, _where = None, _fields = None, _desc = False):
+        """
+        游标分页(keyset)：按唯一键排序，以上一页最后一条数据的键值为起点查询下一页
+        - 与 page() 的 LIMIT offset,count 不同，每页查询耗时与页码无关
+        :param str _table: 表
+        :param str|list _key: 排序键(唯一键 或 联合唯一键，需要有索引)
+        :param int _count: 每页数据量
+        :param str|dict _where: 查询条件
+        :param str|None _fields: 查询字段(必须包含 _key)
+        :param bool _desc: 是否倒序
+        :return: SQL 语句(get_sql 时，第一页) | 生成器，每次返回一页 list[dict]
+        :rtype: str or generator
+        """
+        keys = [_key] if isinstance(_key, str) else list(_key)
+        if not keys:
+            raise ValueError('Param \'_key\' can not be empty', 'mysql')
+        if self.__check:
+            self.get_keyset(_table, keys, _count, _where, _fields, _desc)
+            return self.query_sql('se')
+
+        _format = self.__format
+        self.set_default()
+        return self.__keyset(_table, keys, _count, _where, _fields, _desc, _format)
+
+    def __keyset(self, _table, _keys, _count, _where, _fields, _desc, _format):
+        """
+        游标分页：生成器
+        :return:
+        :rtype: generator
+        """
+        last = None
+        while True:
+            self.get_keyset(_table, _keys, _count, _where, _fields, _desc, last)
+            self.__format = _format
+            rows = self.query_sql('se')
+            if rows is False:
+                raise RuntimeError('Query failed: ' + str(_table), 'mysql')
+            count = len(rows[self.__columns[0]]) if _format in COLUMN_FORMATS and rows else len(rows)
+            if not count:
+                break
+            yield rows
+            if count < _count:
+                break
+            try:
+                last = []
+                for k in _keys:
+                    k = k.split('.')[-1]
+                    if _format in COLUMN_FORMATS:
+                        value = rows[k][-1]
+                        # numpy 数值转换为 python 类型
+                        last.append(value.item() if hasattr(value, 'item') else value)
+                    elif _format == 'dict':
+                        last.append(rows[-1][k])
+                    else:
+                        last.append(rows[-1][self.__columns.index(k)])
+            except (KeyError, ValueError):
+                raise ValueError('Param \'_fields\' must include \'_key\'', 'mysql')
+
+    def get_keyset(self, _table, _keys, _count, _where = None, _fields = None, _desc = False, _last = None):
+        """
+        获取 游标分页 SQL
+        :param str _table: 表
+        :param list _keys: 排序键
+        :param int _count: 每页数据量
+        :param str|dict _where: 查询条件
+        :param str|None _fields: 查询字段
+        :param bool _desc: 是否倒序
+        :param list|None _last: 上一页最后一条数据的键值
+        :return:
+        """
+        self.get_where(_where)
+        where = self.__where
+        if _last is not None:
+            # 联合键：(a > x) OR (a = x AND b > y) ...
+            operator = '<' if _desc else '>'
+            lst = []
+            for i, k in enumerate(_keys):
+                cond = [get_column(col) + ' = %s' for col in _keys[:i]]
+                cond.append(get_column(k) + ' ' + operator + ' %s')
+                lst.append('(' + ' AND '.join(cond) + ')')
+                self.__param.extend(_last[:i + 1])
+            seek = '(' + ' OR '.join(lst) + ')'
+            where = ' WHERE (' + where[7:] + ') AND ' + seek if where else ' WHERE ' + seek
+        order = ','.join([get_column(k) + (' DESC' if _desc else ' ASC') for k in _keys])
+        self.__sql = 'SELECT ' + raw(_fields if _fields else '*') + ' FROM ' + raw(_table) + where + \
+            ' ORDER BY ' + order + ' LIMIT ' + str(int(_count))
+
+    def cache(self, _ttl = 60):
+        """
+        缓存 查询结果(只对下一次 select、selects、count、sum 生效)
+        - 通过 MySql 修改(add、adds、update、delete 等)表时，自动删除该表的缓存
+        - 事务中、batch_commit 有未提交的写入时，不读取也不写入缓存
+        :param int _ttl: 缓存时间(单位：秒)
+        :return:
+        """
+        self.__cache_ttl = _ttl
+        return self
+
+    def row_format(self, _format = 'dict'):
+        """
+        设置 查询结果格式(只对下一次查询生效)
+        :param str _format: 格式
+            - dict -> list[dict] (默认)
+            - tuple -> list[tuple] (不组装字典，最快)
+            - namedtuple -> list[namedtuple]
+            - column -> {字段: list} (按列返回)
+            - array -> {字段: array.array} (数值列为 int64/float64 数组，其他列为 list)
+            - numpy -> {字段: numpy.ndarray} (需安装 numpy)
+        :return:
+        """
+        if _format not in ROW_FORMATS:
+            raise ValueError('Param \'_format\' must be one of ' + ', '.join(ROW_FORMATS), 'mysql')
+        self.__format = _format
+        return self
+
+    def primary(self):
+        """
+        下一次查询强制使用主库(如：刚写入的数据，从库可能还未同步)
+        :return:
+        """
+        self.__primary = True
         return self
 
     def get_sql(self, _check = True):
@@ -300,9 +1335,17 @@ class MySql(object):
         self.__check = _check
         return self
 
+    def get_query(self):
+        """
+        获取 SQL 及参数，不执行：下一次操作返回 (执行类型, SQL, 参数, 查询结果格式)
+        :return:
+        """
+        self.__check = 'query'
+        return self
+
     def get_where(self, _where = None, _alter = False):
         """
-        获取查询条件
+        获取查询条件：条件值使用占位符 %s，值依次记录到 self.__param
         :param dict|str _where: 条件
         :param bool _alter: 是否记录日志
         :return:
@@ -313,10 +1356,10 @@ class MySql(object):
                 for i, row in _where.items():
                     # 跳过数字
                     if tools.is_number(i):  # 处理 i = 'id=1'
-                        lst.append(row)
+                        lst.append(raw(row))
                         continue
                     else:
-                        i = str(i)
+                        i = raw(i)
                         if i.find('.') >= 0:  # 处理 i = 'A.id'
                             columns = i.split('.')
                             key = columns[0] + '.' + '`' + str(columns[1]) + '` '
@@ -326,38 +1369,43 @@ class MySql(object):
                         for j, col in row.items():
                             if j.lower() == 'in' and col:  # 处理 in
                                 if isinstance(col, list):  # where['name']['in'] = []
-                                    new = []
-                                    for item in col:
-                                        new.append('\'' + str(item) + '\'')
-                                    value = j + ' (' + (','.join(new)) + ')'
+                                    value = j + ' (' + (','.join(['%s'] * len(col))) + ')'
+                                    self.__param.extend([str(item) for item in col])
                                 elif isinstance(col, str):  # where['name']['in'] = 'abc'
                                     col = col.lstrip('(')
                                     col = col.rstrip(')')
-                                    value = j + ' (' + col + ')'
+                                    value = j + ' (' + raw(col) + ')'
                                 elif tools.is_number(col):  # where['name']['in'] = 1
-                                    value = j + ' (' + str(col) + ')'
+                                    value = j + ' (%s)'
+                                    self.__param.append(col)
                                 else:
                                     continue
                             elif j.lower() == 'like' and col and not tools.is_array(col):  # 处理 like
-                                value = j + ' \'' + str(col).strip("'") + '\''
+                                value = j + ' %s'
+                                self.__param.append(str(col).strip("'"))
                             elif j in ['>', '<', '=', '>=', '<=', '!=', '<>'] and not tools.is_array(col):
                                 # 处理 > , < , = , >= , <= , != , <>
-                                value = j + ' \'' + str(col) + '\''
+                                value = j + ' %s'
+                                self.__param.append(str(col))
                             else:
                                 continue
 
                             lst.append(key + value)
                     else:  # 处理 =
                         if isinstance(row, str):  # str 类型
-                            value = '= \'' + row + '\''
+                            value = '= %s'
+                            self.__param.append(row)
                             lst.append(key + value)
                         elif isinstance(row, int):
-                            value = '= ' + str(row)
+                            value = '= %s'
+                            self.__param.append(row)
                             lst.append(key + value)
                         else:
                             continue
 
                 _where = ' && '.join(lst)
+            else:
+                _where = raw(_where)
 
             if _where:
                 self.__where = ' WHERE ' + _where
@@ -371,7 +1419,7 @@ class MySql(object):
         :return:
         """
         if _order:
-            self.__order = ' ORDER BY ' + _order
+            self.__order = ' ORDER BY ' + raw(_order)
         else:
             self.__order = ''
 
@@ -382,57 +1430,93 @@ class MySql(object):
         :return:
         """
         if _group:
-            self.__group = ' GROUP BY ' + _group
+            self.__group = ' GROUP BY ' + raw(_group)
         else:
             self.__group = ''
 
-    def query_sql(self, _type = 's', _sql = ''):
+    def query_sql(self, _type = 's', _sql = '', _param = None):
         """
         执行 SQL
         :param str _type: 执行类型 s -> 查询单条 | se -> 查询多条 | u -> 修改 | a -> 添加 | d -> 删除
         :param str _sql: SQL 语句
+        :param list|tuple|None _param: _sql 中占位符 %s 对应的值；为空时，_sql 原样执行
         :return:
         :rtype: bool, int, list or dict
         """
         if _sql:
             self.__sql = _sql
+            param = _param
+        else:
+            # 拼接的 SQL：固定内容中的 % 已转义为 %%
+            param = tuple(self.__param)
 
-        if self.__check:
-            result = self.__sql
+        # 查询结果缓存：事务中、有未提交的写入时不使用(可能读到未提交的数据)
+        cache_key = None
+        if self.__cache_ttl and self.__table and (_type == 's' or _type == 'se') and not self.__check and not (
+                self.__transaction or self.__pending):
+            cache_key = hashlib.sha1(repr((self.__cache_key, _type, self.__sql, param, self.__format)).encode(
+                'utf-8')).hexdigest()
+            result = self.__cache.get(cache_key)
+            if result is not None:
+                self.set_default()
+                return result
+
+        if self.__check == 'query':
+            result = (_type, self.__sql, param, self.__format)
+            # 恢复默认值
+            self.set_default()
+            return result
+        elif self.__check:
+            result = self.__cur.mogrify(self.__sql, param)
             # 恢复默认值
             self.set_default()
             return result
 
+        sql = self.__sql
+        rows = None
+        start = time.time()
+        # 读写分离：查询优先使用从库(事务中、有未提交的语句、指定主库时除外)
+        replica = None
+        if (_type == 's' or _type == 'se') and self.__replicas and not (
+                self.__primary or self.__transaction or self.__pending):
+            replica = self.__get_replica()
+        cur = replica[1].cursor() if replica else self.__cur
         try:
-            rows = self.__cur.execute(self.__sql)
+            if replica:
+                try:
+                    rows = cur.execute(sql, param)
+                    self.__replicas.record(replica[0], time.time() - start)
+                except pymysql.err.OperationalError as e:
+                    # 连接错误才回退，SQL 本身的错误不回退
+                    if not is_connection_error(e):
+                        raise
+                    # 从库不可用：回退到主库
+                    cur.close()
+                    self.__put_replica(replica, e)
+                    replica = None
+                    cur = self.__cur
+                    rows = cur.execute(sql, param)
+            else:
+                rows = cur.execute(sql, param)
             if _type == 's':
                 # 执行 SQL 语句
                 # 获取单条数据
-                data = self.__cur.fetchone()
+                data = cur.fetchone()
                 result = {}
                 if data:
-                    cols_list = []
-                    for field in self.__cur.description:
-                        cols_list.append(field[0])
-
-                    for k, v in enumerate(data):
-                        result[cols_list[k]] = v
+                    self.__columns = [field[0] for field in cur.description]
+                    result = get_rows([data], self.__columns, self.__format, get_types(cur.description))
+                    result = result if self.__format in COLUMN_FORMATS else result[0]
             elif _type == 'se':
                 # 获取数据
-                data = self.__cur.fetchall()
-                result = []
-                if data:
-                    cols_list = []
-                    for field in self.__cur.description:
-                        cols_list.append(field[0])
-
-                    for item in data:
-                        arr = {}
-                        for k, v in enumerate(item):
-                            arr[cols_list[k]] = v
-                        result.append(arr)
+                data = cur.fetchall()
+                self.__columns = [field[0] for field in cur.description] if cur.description else []
+                result = get_rows(data, self.__columns, self.__format,
+                                  get_types(cur.description) if cur.description else None)
             elif _type == 'u' or _type == 'a' or _type == 'd':
-                self.__conn.commit()
+                if self.__table:
+                    self.__touched.update(get_tables(self.__table))
+                self.commit()
                 if _type == 'a':
                     result = self.__cur.lastrowid
                 else:
@@ -441,16 +1525,158 @@ class MySql(object):
                 result = False
         except Exception as e:
             tools.logs('/mysql/error',
-                       {'file_type': 'mysql', 'message': e, 'sql': self.__sql},
+                       {'file_type': 'mysql', 'message': e, 'sql': self.get_statement(self.__sql, param)},
                        'error',
                        _type = 3)
+            # 事务中报错：抛出异常，由 transaction() 回滚
+            if self.__transaction:
+                self.set_default()
+                raise
             result = False
+        finally:
+            if replica:
+                cur.close()
+                self.__put_replica(replica)
+            # 耗时统计
+            stats.record('mysql', stats.get_shape(sql), time.time() - start, rows, len(sql), [sql, param])
+
+        if cache_key and result is not False:
+            self.__cache.set(cache_key, get_tables(self.__table), result, self.__cache_ttl)
 
         # 恢复默认值
         self.set_default()
 
         return result
 
+    def __get_replica(self):
+        """
+        从从库连接池借出连接：从库都不可用时返回 None (使用主库)
+        :return: None | (从库序号, 连接)
+        :rtype: tuple or None
+        """
+        tried = set()
+        while True:
+            index = self.__replicas.choose(tried)
+            if index is None:
+                return None
+            tried.add(index)
+            try:
+                return index, self.__replicas.get_pool(index).get()
+            except Exception as e:
+                self.__replicas.mark_down(index)
+                tools.logs('/mysql/error',
+                           {'file_type': 'mysql', 'message': e, 'replica': self.__replicas.hosts[index]},
+                           'error',
+                           _type = 3)
+
+    def __put_replica(self, _replica, _error = None):
+        """
+        归还从库连接
+        :param tuple _replica: (从库序号, 连接)
+        :param Exception|None _error: 从库报错：关闭连接，标记不可用
+        :return:
+        """
+        index, conn = _replica
+        if _error is not None:
+            # 已关闭的连接，归还时由连接池丢弃
+            try:
+                conn.close()
+            except Exception:
+                pass
+            self.__replicas.mark_down(index)
+            tools.logs('/mysql/error',
+                       {'file_type': 'mysql', 'message': _error, 'replica': self.__replicas.hosts[index]},
+                       'error',
+                       _type = 3)
+        self.__replicas.get_pool(index).put(conn)
+
+    def commit(self, _force = False):
+        """
+        提交
+        - 事务中：不提交，由 transaction() 结束时提交
+        - 批量提交模式：累计 n 条语句 或 超过 n 毫秒才提交
+        :param bool _force: 是否立即提交(事务中除外)
+        :return:
+        """
+        if self.__transaction:
+            return
+        if self.__batch and not _force:
+            self.__pending += 1
+            if self.__pending == 1:
+                self.__pending_time = time.time()
+            if self.__pending < self.__batch[0] and (time.time() - self.__pending_time) * 1000 < self.__batch[1]:
+                return
+        self.__commit()
+
+    def __commit(self):
+        """
+        提交连接，并删除本次提交修改的表的缓存(提交前其他连接仍可能读到并缓存旧数据)
+        :return:
+        """
+        self.__conn.commit()
+        self.__pending = 0
+        if self.__touched:
+            tables = list(self.__touched)
+            self.__touched.clear()
+            self.__cache.invalidate(tables)
+
+    def rollback(self):
+        """
+        回滚(包括批量提交模式中未提交的语句)
+        :return:
+        """
+        self.__pending = 0
+        self.__touched.clear()
+        self.__conn.rollback()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        事务：代码块结束时提交，报错时回滚
+        - 例子：with db.transaction(): db.update(...); db.add(...)
+        - 事务中 SQL 执行失败会抛出异常(不再返回 False)
+        - 嵌套使用时，并入最外层事务
+        :return:
+        """
+        if self.__transaction:
+            yield self
+            return
+        # 先提交 批量提交模式中未提交的语句
+        if self.__pending:
+            self.commit(True)
+        self.__transaction = True
+        try:
+            yield self
+        except BaseException:
+            self.__transaction = False
+            self.rollback()
+            raise
+        self.__transaction = False
+        self.__commit()
+
+    @contextlib.contextmanager
+    def batch_commit(self, _count = 1000, _ms = 1000):
+        """
+        批量提交：代码块中的写操作每 _count 条 或 每 _ms 毫秒提交一次，结束时提交剩余部分，报错时回滚未提交部分
+        - 例子：with db.batch_commit(500): for row in rows: db.update(...)
+        :param int _count: 每 n 条语句提交一次
+        :param int _ms: 距第一条未提交语句超过 n 毫秒时提交
+        :return:
+        """
+        old = self.__batch
+        if self.__pending:
+            self.commit(True)
+        self.__batch = (int(_count), int(_ms))
+        try:
+            yield self
+        except BaseException:
+            self.rollback()
+            self.__batch = old
+            raise
+        if self.__pending:
+            self.commit(True)
+        self.__batch = old
+
     def py_log(self, _type, **kwargs):
         """
         python 日志表
@@ -495,14 +1721,28 @@ class MySql(object):
         :return:
         """
         msg = inspect.stack()[-2]
+        # 参数化写入，不需要转义
         param = {
-            'path': re.escape(msg),
+            'path': '{}:{} {}'.format(msg.filename, msg.lineno, msg.function),
             'add_time': tools.get_date('%Y-%m-%d %H:%M:%S')
         }
         if remark:
-            param['remark'] = re.escape(remark) if isinstance(remark, str) else remark
+            param['remark'] = remark
         self.add('_log_error', param)
 
+    def get_statement(self, _sql, _param = None):
+        """
+        获取 代入参数后的 SQL(用于日志)
+        :param str _sql: SQL 语句
+        :param list|tuple|None _param: 参数
+        :return: 代入失败时，返回 SQL 及参数
+        :rtype: str
+        """
+        try:
+            return self.__cur.mogrify(_sql, _param)
+        except Exception:
+            return '{} {}'.format(_sql, _param)
+
     def get_last_id(self):
         """
         获取最新增加的id
@@ -510,10 +1750,335 @@ class MySql(object):
         """
         return self.__cur.lastrowid
 
-    def close_db(self):
-        self.__conn.close()
+    def close_db(self, _commit = True):
+        """
+        归还连接到连接池
+        :param bool _commit: 是否提交 批量提交模式中未提交的语句；False -> 回滚(归还连接时回滚)
+        """
+        if self.__conn:
+            # 提交 批量提交模式中未提交的语句
+            if _commit and self.__pending and not self.__transaction:
+                self.commit(True)
+            self.__pending = 0
+            self.__touched.clear()
+            self.__cur.close()
+            self.__pool.put(self.__conn)
+            self.__conn = None
+            self.__cur = None
         self.set_default()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close_db()
+
+    def __del__(self):
+        # 未调用 close_db 时，对象销毁前归还连接：不提交未提交的语句(由连接池回滚)
+        if getattr(self, '_MySql__conn', None):
+            self.close_db(False)
+
+
+class SortKey(object):
+    __slots__ = ('values', 'desc')
+
+    def __init__(self, _values, _desc):
+        """
+        多字段排序的键(各字段可分别升序、降序；NULL 与 MySql 相同，视为最小值)
+        :param tuple _values: 排序字段的值
+        :param tuple _desc: 各字段是否降序
+        """
+        self.values = _values
+        self.desc = _desc
+
+    def __lt__(self, other):
+        for a, b, desc in zip(self.values, other.values, self.desc):
+            if a == b:
+                continue
+            if a is None or b is None:
+                return (a is None) != desc
+            return a > b if desc else a < b
+        return False
+
+
+def get_sort_key(_order):
+    """
+    获取 合并多个有序结果时的排序函数
+    :param str _order: 排序：a DESC, b | A.a DESC
+    :return:
+    :rtype: function
+    """
+    columns = []
+    desc = []
+    for item in _order.split(','):
+        item = item.split()
+        if not item:
+            continue
+        columns.append(item[0].split('.')[-1].strip('`'))
+        desc.append(len(item) > 1 and item[1].upper() == 'DESC')
+    desc = tuple(desc)
+
+    return lambda row: SortKey(tuple(row.get(col) for col in columns), desc)
+
+
+# 分片键支持的日期字符串格式
+SHARD_DATE_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d', '%Y-%m', '%Y%m%d', '%Y-%m-%d %H:%M:%S.%f')
+
+
+def get_shard_date(_value):
+    """
+    获取 分片键的日期(统一转换为 datetime，用于比较)
+    :param str|int|datetime.date _value: 日期字符串 | 时间戳 | date、datetime
+    :return:
+    :rtype: datetime.datetime
+    """
+    if isinstance(_value, datetime.datetime):
+        return _value
+    elif isinstance(_value, datetime.date):
+        return datetime.datetime.combine(_value, datetime.time())
+    elif tools.is_number(_value) and not isinstance(_value, str):
+        return datetime.datetime.fromtimestamp(_value)
+    value = str(_value).strip()
+    for _format in SHARD_DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, _format)
+        except ValueError:
+            continue
+    raise ValueError('Shard date \'' + value + '\' is wrong', 'mysql')
+
+
+class ShardRouter(object):
+    def __init__(self, _table, _key, _shards, _mode = 'hash', _workers = 8):
+        """
+        初始化：把逻辑表分散到多个 物理表/数据库
+        :param str _table: 逻辑表名(只用于日志)
+        :param str _key: 分片键(字段名)
+        :param list _shards: 分片 [{'table': 物理表, 'section': 配置分组(默认 mysql), 'conf': 配置(优先于 section),
+                                    'start': date 模式时，本分片的起始日期(包含)}, ...]
+        :param str _mode: 分片方式
+            - hash -> 按分片键的 crc32 取模
+            - date -> 按分片键的日期范围(分片按 start 升序排列，日期早于第一个分片的数据归入第一个分片)
+        :param int _workers: 并行查询的最大线程数
+        """
+        if _mode not in ('hash', 'date'):
+            raise ValueError('Param \'_mode\' must be hash or date', 'mysql')
+        if not _shards:
+            raise ValueError('Param \'_shards\' can not be empty', 'mysql')
+        self.table = _table
+        self.key = _key
+        self.__mode = _mode
+        self.__workers = _workers
+        self.__shards = []
+        for shard in _shards:
+            if 'table' not in shard:
+                raise ConfigError('Miss table', 'mysql')
+            if _mode == 'date' and 'start' not in shard:
+                raise ConfigError('Miss start', 'mysql')
+            self.__shards.append({
+                'table': shard['table'],
+                'conf': shard['conf'] if shard.get('conf') else tools.configs(_section = shard.get('section', 'mysql')),
+                'start': get_shard_date(shard['start']) if _mode == 'date' else None,
+            })
+        if _mode == 'date':
+            self.__shards.sort(key = lambda x: x['start'])
+        self.__limit = None  # 分页：(偏移量, 数据量)
+
+    def get_shard(self, _value):
+        """
+        获取 分片键的值所在的分片
+        :param _value: 分片键的值
+        :return: 分片序号
+        :rtype: int
+        """
+        if _value is None:
+            raise ValueError('Shard key \'' + self.key + '\' can not be empty', 'mysql')
+        if self.__mode == 'hash':
+            return zlib.crc32(str(_value).encode('utf-8')) % len(self.__shards)
+        value = get_shard_date(_value)
+        index = 0
+        for i, shard in enumerate(self.__shards):
+            if shard['start'] > value:
+                break
+            index = i
+        return index
+
+    def get_shards(self, _where = None):
+        """
+        获取 查询条件涉及的分片：分片键为 =、in 或(date 模式)范围条件时，只查询相关分片
+        :param str|dict|None _where: 查询条件，同 MySql.get_where
+        :return: 分片序号
+        :rtype: list
+        """
+        indexes = list(range(len(self.__shards)))
+        if not isinstance(_where, dict) or self.key not in _where:
+            return indexes
+        cond = _where[self.key]
+        if isinstance(cond, (str, int)):
+            return [self.get_shard(cond)]
+        if not isinstance(cond, dict):
+            return indexes
+        for j, col in cond.items():
+            j = j.lower()
+            if j == 'in' and isinstance(col, list):
+                return sorted(set(self.get_shard(v) for v in col))
+            if j == '=' and not tools.is_array(col):
+                return [self.get_shard(col)]
+        if self.__mode != 'date':
+            return indexes
+
+        # date 模式：分片 i 的范围为 [start_i, start_i+1)
+        for j, col in cond.items():
+            if tools.is_array(col):
+                continue
+            value = get_shard_date(col)
+            if j in ('>', '>='):
+                first = self.get_shard(value)
+                indexes = [i for i in indexes if i >= first]
+            elif j == '<':
+                indexes = [i for i in indexes if i == 0 or self.__shards[i]['start'] < value]
+            elif j == '<=':
+                indexes = [i for i in indexes if i == 0 or self.__shards[i]['start'] <= value]
+        return indexes
+
+    def run(self, _func, _indexes = None):
+        """
+        在多个分片上并行执行
+        :param function _func: _func(MySql, 物理表, 分片序号) -> 结果
+        :param list|None _indexes: 分片序号；默认：全部分片
+        :return: 各分片的结果(与 _indexes 顺序相同)
+        :rtype: list
+        """
+        if _indexes is None:
+            _indexes = list(range(len(self.__shards)))
+
+        def call(_index):
+            shard = self.__shards[_index]
+            with MySql(shard['conf']) as db:
+                return _func(db, shard['table'], _index)
+
+        if len(_indexes) <= 1:
+            return [call(i) for i in _indexes]
+        with concurrent.futures.ThreadPoolExecutor(min(len(_indexes), self.__workers)) as executor:
+            return list(executor.map(call, _indexes))
+
+    def add(self, _param = None):
+        """
+        添加单条数据：按分片键写入对应分片
+        :param dict _param: 添加内容(必须包含分片键)
+        :return: False | 新增id
+        :rtype: bool or int
+        """
+        if not _param:
+            return False
+        index = self.get_shard(_param.get(self.key))
+        return self.run(lambda db, table, index: db.add(table, _param), [index])[0]
+
+    def adds(self, _params = None, _mode = None, _update = None, _chunk = 1000):
+        """
+        添加多条数据：按分片键分组，各分片并行 bulk_add
+        :param list _params: 添加内容(每条必须包含分片键)
+        :param str|None _mode: 同 MySql.bulk_add
+        :param list|None _update: 同 MySql.bulk_add
+        :param int _chunk: 同 MySql.bulk_add
+        :return: False -> 任一分片失败 | 添加数量
+        :rtype: bool or int
+        """
+        groups = {}
+        for item in _params or []:
+            if isinstance(item, dict):
+                groups.setdefault(self.get_shard(item.get(self.key)), []).append(item)
+        if not groups:
+            return False
+        result = self.run(lambda db, table, index: db.bulk_add(table, groups[index], _mode, _update, _chunk),
+                          sorted(groups.keys()))
+        if not all(result):
+            return False
+
+        return sum(item['rows'] for item in result)
+
+    def selects(self, _order = None, _key = None, _where = None):
+        """
+        查询多条数据：各分片并行查询，按 _order 归并排序(不支持 GROUP BY)
+        - 分页时，每个分片查询 偏移量 + 数据量 条，合并后再截取
+        :param str|None _order: 排序(排序字段必须在 _key 中)
+        :param str|None _key: 查询字段
+        :param str|dict|None _where: 查询条件，同 MySql.selects
+        :return: False | list
+        :rtype: list or bool
+        """
+        limit = self.__limit
+        self.__limit = None
+
+        def query(_db, _table, _index):
+            if limit:
+                _db.page(1, limit[0] + limit[1])
+            return _db.selects(_table, _order, _key, _where)
+
+        result = self.run(query, self.get_shards(_where))
+        if any(item is False for item in result):
+            return False
+        if _order:
+            rows = heapq.merge(*result, key = get_sort_key(_order))
+        else:
+            rows = itertools.chain(*result)
+        if limit:
+            rows = itertools.islice(rows, limit[0], limit[0] + limit[1])
+
+        return list(rows)
+
+    def count(self, _where = None):
+        """
+        数据量统计：各分片并行统计后求和
+        :param str|dict|None _where: 查询条件
+        :return: False -> 任一分片失败 | 总数据量
+        :rtype: bool or int
+        """
+        return self.get_total(lambda db, table: db.count(table, _where), _where)
+
+    def sum(self, _key = None, _where = None):
+        """
+        求和：各分片并行求和后相加
+        :param str _key: 求和字段
+        :param str|dict|None _where: 查询条件
+        :return: False -> 任一分片失败 | 总和
+        :rtype: bool, int or float
+        """
+        if not _key:
+            return False
+        return self.get_total(lambda db, table: db.sum(table, _key, _where), _where)
+
+    def get_total(self, _func, _where = None):
+        """
+        执行 count、sum：MySql.count、sum 失败时返回 0，这里通过 get_query 拼接 SQL 后执行，以区分失败
+        :param function _func: _func(MySql, 物理表) -> 查询
+        :param str|dict|None _where: 查询条件
+        :return: False -> 任一分片失败 | 合计
+        :rtype: bool, int or float
+        """
+        def query(_db, _table, _index):
+            result = _db.query_sql(*_func(_db.get_query(), _table)[:3])
+            if result is False:
+                return False
+            return result.get('total') if result else 0
+
+        result = self.run(query, self.get_shards(_where))
+        if any(item is False for item in result):
+            return False
+
+        return sum(item for item in result if item)
+
+    def page(self, _page, _count = 10):
+        """
+        分页(只对下一次 selects 生效)
+        :param int _page: 页码
+        :param int _count: 每页数据量
+        :return:
+        """
+        if _count:
+            self.__limit = (int(_count) * (int(_page) - 1), int(_count))
+        return self
+
+
 # if __name__ == '__main__':
 #     M = MySQL()
 #     sql = 'SELECT * FROM `game` WHERE `id`=%s'
@@ -0,0 +1,177 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+常驻任务进程
+    - 1、启动： python index.py --serve
+    - 2、提交任务： server.submit('/test/task2', {'start': '2019-01-01'})
+    - 3、配置(config/common.ini)：
+        [server]
+        socket = /data/time_task/log/index.sock  # 本地 socket 路径，默认：log/index.sock
+        workers = 4                              # 子进程数量，默认：CPU 核数
+        max_tasks = 0                            # 子进程执行 n 个任务后重启，默认：0 -> 不重启
+"""
+import os
+import json
+import socket
+import socketserver
+import importlib
+import multiprocessing
+from urllib import parse
+
+# 自定义模块
+from mytools import tools
+
+
+def get_config():
+    """
+    获取常驻进程配置
+    :return:
+    :rtype: dict
+    """
+    conf = tools.configs(_section = 'server')
+    return {
+        'socket': conf['socket'] if 'socket' in conf else tools.ROOT_PATH + '/log/index.sock',
+        'workers': int(conf['workers']) if 'workers' in conf else None,
+        'max_tasks': int(conf['max_tasks']) if 'max_tasks' in conf else 0,
+    }
+
+
+class TaskHandler(socketserver.StreamRequestHandler):
+    """
+    接收任务：每行一个 json -> {"path": "/xxx/xxx", "params": "a=1&b=2"}
+    """
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            data = json.loads(line.decode('utf-8'))
+            path = str(data['path'])
+            params = data['params'] if 'params' in data else None
+        except (ValueError, KeyError, TypeError):
+            return self.reply(1, 'Bad request')
+
+        self.server.pool.apply_async(self.server.func, (path, params))
+        self.reply(0, 'ok')
+
+    def reply(self, _code, _msg):
+        """
+        返回处理结果
+        :param int _code: 0 -> 成功 | 1 -> 失败
+        :param str _msg:
+        :return:
+        """
+        self.wfile.write((json.dumps({'code': _code, 'msg': _msg}) + '\n').encode('utf-8'))
+
+
+class TaskServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, _path, _pool, _func):
+        """
+        初始化
+        :param str _path: socket 路径
+        :param multiprocessing.pool.Pool _pool: 子进程池
+        :param function _func: 任务执行函数 _func(path, params)
+        """
+        self.pool = _pool
+        self.func = _func
+        socketserver.UnixStreamServer.__init__(self, _path, TaskHandler)
+
+
+def init_worker():
+    """
+    子进程初始化：预加载 task 目录下的所有任务模块，省去每次执行任务时的 import 耗时
+    """
+    task_dir = tools.ROOT_PATH + '/task'
+    for name in sorted(os.listdir(task_dir)):
+        if not name.endswith('.py') or not name[0].isupper():
+            continue
+        try:
+            importlib.import_module('task.' + name[:-3])
+        except Exception as e:
+            tools.logs('/server/error',
+                       {'file_type': 'server', 'message': e, 'module': name},
+                       'error',
+                       _type = 3)
+
+
+def serve(_func):
+    """
+    启动常驻进程
+    :param function _func: 任务执行函数 _func(path, params)
+    :return:
+    """
+    conf = get_config()
+    path = conf['socket']
+    if os.path.exists(path):
+        if ping():
+            raise RuntimeError('Server is already running: ' + path, 'server')
+        # 上次未正常退出，遗留的 socket 文件
+        os.remove(path)
+    tools.mk_dir(path)
+
+    # 使用 fork 方式创建子进程：子进程继承已加载的模块
+    context = multiprocessing.get_context('fork')
+    pool = context.Pool(processes = conf['workers'],
+                        initializer = init_worker,
+                        maxtasksperchild = conf['max_tasks'] or None)
+    server = TaskServer(path, pool, _func)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        # 跳过，主动断开
+        pass
+    finally:
+        server.server_close()
+        pool.close()
+        pool.join()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def send(_data, _timeout = 3):
+    """
+    向常驻进程发送数据
+    :param dict _data:
+    :param int _timeout: 超时时间(单位：秒)
+    :return: False | 返回结果
+    :rtype: bool or dict
+    """
+    path = get_config()['socket']
+    if not os.path.exists(path):
+        return False
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(_timeout)
+            client.connect(path)
+            client.sendall((json.dumps(_data) + '\n').encode('utf-8'))
+            with client.makefile('rb') as fpr:
+                reply = fpr.readline()
+        return json.loads(reply.decode('utf-8'))
+    except (OSError, ValueError):
+        return False
+
+
+def ping():
+    """
+    常驻进程是否已启动
+    :return:
+    :rtype: bool
+    """
+    return send({}) is not False
+
+
+def submit(_path, _params = None):
+    """
+    提交任务到常驻进程
+    :param str _path: 执行方法路径：/xxx/xxx
+    :param dict or str _params: 请求参数
+    :return: True -> 已提交 | False -> 常驻进程未启动
+    :rtype: bool
+    """
+    if isinstance(_params, dict):
+        _params = parse.urlencode(_params)  # url 编码
+    result = send({
+        'path': '/' + _path.strip('/'),
+        'params': _params if _params else None,
+    })
+    return bool(result) and result['code'] == 0
@@ -0,0 +1,220 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+执行耗时统计模块
+    - 1、记录： stats.record('mysql', sql, 0.12, _rows = 10, _sql_len = 120)
+    - 2、装饰器： @stats.watch('mongo', '_where')
+    - 3、钩子： stats.add_hook(func) -> 每次记录时调用 func({'kind':, 'shape':, 'seconds':, 'rows':, 'sql_len':})
+    - 4、汇总： stats.summary(10) -> 按总耗时排序的前 n 条；index.py 任务结束时自动写入 log/stats/summary_yyyy-mm-dd.log
+    - 配置(config/common.ini)：
+        [stats]
+        slow = 1    # 慢查询阈值(单位：秒)，超过时写入 log/slow/<kind>_yyyy-mm-dd.log；默认：1
+        top = 10    # 任务结束时记录的汇总条数；默认：10
+"""
+import re
+import time
+import inspect
+import functools
+import threading
+
+# 自定义模块
+from mytools import tools
+
+
+# 汇总：{(类型, 语句结构): [次数, 总耗时, 最大耗时, 总行数, 总语句长度]}
+_summary = {}
+# 后台写入、分片、并行扫描的线程也会记录
+_summary_lock = threading.Lock()
+
+# 钩子
+_hooks = []
+
+# 配置
+_config = None
+
+
+def get_config():
+    """
+    获取配置
+    :return:
+    :rtype: dict
+    """
+    global _config
+    if _config is None:
+        conf = tools.configs(_section = 'stats')
+        _config = {
+            'slow': float(conf['slow']) if 'slow' in conf else 1.0,
+            'top': int(conf['top']) if 'top' in conf else 10,
+        }
+    return _config
+
+
+def add_hook(_func):
+    """
+    添加钩子
+    :param function _func: _func(记录)
+    :return:
+    """
+    _hooks.append(_func)
+
+
+def remove_hook(_func):
+    """
+    移除钩子
+    :param function _func:
+    :return:
+    """
+    if _func in _hooks:
+        _hooks.remove(_func)
+
+
+def get_shape(_sql):
+    """
+    获取 SQL 结构：字符串、数字替换为 ?，相同结构的语句合并统计
+    :param str _sql:
+    :return:
+    :rtype: str
+    """
+    _sql = re.sub(r"'(?:[^'\\]|\\.)*'", '?', str(_sql))
+    _sql = re.sub(r'\b\d+\b', '?', _sql)
+    return re.sub(r'\s+', ' ', _sql).strip()
+
+
+def get_mongo_shape(_data):
+    """
+    获取 Mongo 查询结构：查询条件只保留键名，管道只保留阶段名
+    :param dict|list|None _data: 查询条件 或 管道
+    :return:
+    :rtype: str
+    """
+    if isinstance(_data, dict):
+        return '{' + ','.join(sorted([str(k) for k in _data.keys()])) + '}'
+    elif isinstance(_data, list):
+        return '[' + ','.join([','.join(item.keys()) if isinstance(item, dict) else '?' for item in _data]) + ']'
+    return ''
+
+
+def record(_kind, _shape, _seconds, _rows = None, _sql_len = None, _detail = None):
+    """
+    记录一次执行
+    :param str _kind: 类型：mysql | mongo
+    :param str _shape: 语句结构
+    :param float _seconds: 耗时(单位：秒)
+    :param int|None _rows: 返回/影响行数
+    :param int|None _sql_len: 语句长度
+    :param any _detail: 慢查询日志中记录的完整内容(如：带参数的 SQL)
+    :return:
+    """
+    with _summary_lock:
+        item = _summary.get((_kind, _shape))
+        if item is None:
+            item = _summary[(_kind, _shape)] = [0, 0.0, 0.0, 0, 0]
+        item[0] += 1
+        item[1] += _seconds
+        item[2] = max(item[2], _seconds)
+        item[3] += _rows if _rows else 0
+        item[4] += _sql_len if _sql_len else 0
+
+    content = {
+        'kind': _kind,
+        'shape': _shape,
+        'seconds': round(_seconds, 6),
+        'rows': _rows,
+        'sql_len': _sql_len,
+    }
+    for hook in _hooks:
+        hook(content)
+
+    # 慢查询
+    if _seconds >= get_config()['slow']:
+        if _detail is not None:
+            content['detail'] = _detail
+        tools.logs('/slow/' + _kind, content, 'warning', _type = 3, _console = False)
+
+
+def watch(_kind, _query = None):
+    """
+    装饰器：记录方法耗时(第一个参数为表名)
+    :param str _kind: 类型
+    :param str|None _query: 作为语句结构的参数名(查询条件 或 管道)
+    :return:
+    """
+    def decorator(_func):
+        names = list(inspect.signature(_func).parameters.keys())
+        pos = names.index(_query) if _query in names else None
+
+        @functools.wraps(_func)
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            result = _func(*args, **kwargs)
+            seconds = time.time() - start
+            table = args[1] if len(args) > 1 else kwargs.get('_table')
+            if pos is None:
+                query = None
+            elif len(args) > pos:
+                query = args[pos]
+            else:
+                query = kwargs.get(_query)
+            if isinstance(result, list):
+                rows = len(result)
+            elif isinstance(result, dict):
+                rows = 1 if result else 0
+            elif isinstance(result, int) and not isinstance(result, bool):
+                rows = result
+            else:
+                rows = None
+            record(_kind, '{}.{} {}'.format(table, _func.__name__, get_mongo_shape(query)).strip(), seconds, rows,
+                   _detail = query)
+            return result
+        return wrapper
+    return decorator
+
+
+def summary(_top = None, _clear = False):
+    """
+    获取汇总：按总耗时倒序
+    :param int|None _top: 前 n 条；默认：全部
+    :param bool _clear: 是否同时清空汇总
+    :return:
+    :rtype: list[dict]
+    """
+    with _summary_lock:
+        items = [(key, list(item)) for key, item in _summary.items()]
+        if _clear:
+            _summary.clear()
+    result = []
+    for (kind, shape), item in items:
+        result.append({
+            'kind': kind,
+            'shape': shape,
+            'count': item[0],
+            'total': round(item[1], 6),
+            'max': round(item[2], 6),
+            'avg': round(item[1] / item[0], 6),
+            'rows': item[3],
+            'sql_len': item[4],
+        })
+    result.sort(key = lambda x: x['total'], reverse = True)
+
+    return result[:_top] if _top else result
+
+
+def reset():
+    """
+    清空汇总
+    :return:
+    """
+    with _summary_lock:
+        _summary.clear()
+
+
+def dump(_path = None):
+    """
+    写入汇总日志并清空
+    :param str|None _path: 本次任务路径
+    :return:
+    """
+    top = summary(get_config()['top'], True)
+    if not top:
+        return
+    tools.logs('/stats/summary', {'path': _path, 'top': top}, 'info', _type = 3, _console = False)
@@ -14,9 +14,17 @@ import requests
 import subprocess
 import pprint
 import inspect
+import array
+import decimal
+import asyncio
 from urllib import parse
 from logging import handlers
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 ROOT_PATH = os.path.dirname(os.path.realpath(__file__)) + '/..'
 
@@ -532,6 +540,11 @@ def request(_path, _data = None):
     :param dict _data: 参数
     :return:
     """
+    # 常驻进程已启动时，直接提交任务，无需再启动新的 python 进程
+    from mytools import server
+    if server.submit(_path, _data if isinstance(_data, dict) else None):
+        return
+
     cmd = 'python ' + ROOT_PATH + '/index.py "/' + _path.strip('/') + '" '
     if _data:
         if isinstance(_data, dict):
@@ -701,6 +714,75 @@ def list_intersect(*args):
     return result if result else []
 
 
+def list_columns(_list):
+    """
+    [{}] 按列转换为 {字段: list}
+    :param list _list:
+    :return: 缺少的字段为 None
+    :rtype: dict
+    """
+    keys = []
+    for item in _list:
+        for k in item:
+            if k not in keys:
+                keys.append(k)
+    result = {}
+    for k in keys:
+        result[k] = [item.get(k) for item in _list]
+
+    return result
+
+
+def array_columns(_columns, _types = None, _format = 'array'):
+    """
+    列数据转换为数组，便于向量化计算
+    :param dict _columns: {字段: list}
+    :param dict|None _types: {字段: int | float}；未指定的字段根据值推断
+    :param str _format: array -> array.array | numpy -> numpy.ndarray
+    :return: 整数列 -> int64 | 浮点数(含 Decimal)列、含 None 的数值列 -> float64(None 为 nan) | 其他 -> list 或 object 数组
+    :rtype: dict
+    """
+    if _format == 'numpy' and numpy is None:
+        raise ImportError('No module named \'numpy\'')
+    _types = _types if _types else {}
+    result = {}
+    for k, values in _columns.items():
+        # 推断类型
+        _type = _types.get(k)
+        has_none = False
+        for v in values:
+            if v is None:
+                has_none = True
+            elif _type in (None, int) and isinstance(v, int) and not isinstance(v, bool):
+                _type = int
+            elif _type in (None, int, float) and isinstance(v, (int, float, decimal.Decimal)) \
+                    and not isinstance(v, bool):
+                _type = float
+            else:
+                _type = object
+                break
+        if _type is int and has_none:
+            _type = float
+        if _type is float:
+            values = [float('nan') if v is None else float(v) for v in values]
+
+        try:
+            if _format == 'numpy':
+                dtype = 'int64' if _type is int else 'float64' if _type is float else object
+                result[k] = numpy.array(values, dtype = dtype)
+            elif _type is int:
+                result[k] = array.array('q', values)
+            elif _type is float:
+                result[k] = array.array('d', values)
+            else:
+                result[k] = list(values)
+        except OverflowError:
+            # 超出 int64 范围
+            result[k] = numpy.array(values, dtype = object) if _format == 'numpy' else list(values)
+
+    return result
+
+
 def set_default_dict(_dict, *args, **kwargs):
     """
     设置 字典默认值
@@ -768,6 +850,39 @@ def file_put_content(_path, _content, _encoding = 'utf-8'):
         fpw.write(_content)
 
 
+async def gather(_coros, _limit = 10):
+    """
+    并发执行协程，同时执行的数量不超过 _limit
+    :param list _coros: 协程
+    :param int _limit: 最大并发数
+    :return: 与 _coros 顺序一致的结果；报错的协程返回异常对象
+    :rtype: list
+    """
+    semaphore = asyncio.Semaphore(_limit)
+
+    async def limit(_coro):
+        async with semaphore:
+            return await _coro
+
+    return await asyncio.gather(*[limit(coro) for coro in _coros], return_exceptions = True)
+
+
+def run_async(_coro):
+    """
+    在同步代码中执行协程
+    :param _coro: 协程
+    :return: 协程返回值
+    """
+    try:
+        loop = asyncio.get_event_loop()
+    except RuntimeError:
+        loop = None
+    if loop is None or loop.is_closed():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+    return loop.run_until_complete(_coro)
+
+
 def get_function_name():
     return inspect.stack()[1][3]
 
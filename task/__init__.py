@@ -1,45 +1,55 @@
 # -*- coding: utf-8 -*-
-import re
-import os
-
 # 引入自定义模块
 from mytools import glob
 from mytools import tools
+from mytools.lock import TaskLock
 
 
 VERSION = 1.0
 
 # 开始执行时间
-_create_date = glob.get_value('create_time')
+_create_date = None
 
 # 请求参数解析：字典类型
-params = glob.get_value('params')
-params = tools.url_decode(params) if params else {}
+params = {}
+
+# 本次任务持有的锁
+_lock = None
+
+
+def init():
+    """加载本次任务的创建时间、请求参数
+    - 常驻进程中任务模块只加载一次，所以每次执行任务前都需要重新加载
+    """
+    global _create_date, params
+    _create_date = glob.get_value('create_time')
+    params = glob.get_value('params')
+    params = tools.url_decode(params) if params else {}
 
 
 def check_task():
     """检测是否存在重复任务
-    - 由于次函数内使用的检测命令是针对Linux的
-    - 所以，在 windows 操作系统中，检测重复会失效
+    - 对 类名/方法名 加文件锁，任务结束(进程退出 或 release_task)时解锁
+    - 已被锁定时，添加请求参数 "again=true" 可忽略检测
     """
-    pid = os.getpid()  # 本次任务进程id
-    _class, _func = glob.get_value('path').split('/')  # 获取执行命令行时的类名、方法名
-    out = tools.request_cmd('ps ax -o pid,command | grep {}/{}'.format(_class, _func), True)[0].split('\n')
-    # 正则文档：https://blog.csdn.net/qq_37968529/article/details/81198654
-    pattern = 'python.+\/index\.py.+{}\/{}'.format(_class, _func)
-    pattern = re.compile(pattern, re.I)  # 预编译，不区分大小写
-    for o in out:
-        # 排除本次执行
-        o = o.strip(str(pid)).strip()
-        if not o or pattern.match(o):
-            continue
-        # 检测旧任务
-        result = pattern.search(o)
-        if result and 'again' not in params:
-            msg = '''This task is in progress. 
-            If your still need to execute, add request parameter "again=true"
-            '''
-            raise ValueError(msg)
-
-
-check_task()
+    global _lock
+    release_task()
+    lock = TaskLock(glob.get_value('path'))
+    if lock.acquire():
+        _lock = lock
+    elif 'again' not in params:
+        msg = '''This task is in progress (pid: {}). 
+        If your still need to execute, add request parameter "again=true"
+        '''.format(lock.get_owner().get('pid'))
+        raise ValueError(msg)
+
+
+def release_task():
+    """释放本次任务的锁"""
+    global _lock
+    if _lock:
+        _lock.release()
+        _lock = None
+
+
+init()